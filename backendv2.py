@@ -3,55 +3,80 @@ from typing import Dict, Optional
 
 from fastapi import FastAPI, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, Response, JSONResponse, RedirectResponse, HTMLResponse
+from fastapi.responses import FileResponse, Response, RedirectResponse, HTMLResponse, ORJSONResponse, StreamingResponse
 
-from collections import deque
-import uuid
+import heapq
+import re
 import os
 import pathlib
-from asgiref.sync import sync_to_async as s2a
-from asyncio import sleep, create_task, TimeoutError as AsyncTimeoutError, wait_for, Timeout, CancelledError
+from asyncio import Event, Queue, Semaphore, create_task, to_thread, get_running_loop, shield, Task, TimeoutError as AsyncTimeoutError, wait_for
 from shutil import rmtree
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import get_context
+from functools import partial
 from contextlib import asynccontextmanager
 from datetime import datetime, timezone
 from dotenv import load_dotenv
 
 import yt_dlp
+import aiohttp
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from starlette.middleware.base import BaseHTTPMiddleware
 
-from manager.ytdlp_tool.ytdl_tools import YTDLP_TOOLS
+from manager.ytdlp_tool.ytdl_tools import YTDLP_TOOLS, run_yt_dlp_download_in_process
+from manager.regex_manager.regex_manager import get_provider_from_url
 from manager.geo_utils.geoblock_checker import is_geo_restricted, get_video_id, GeoblockData
 from manager.models.request_class import DownloadRequest, FormatRequest, DataResponse, DownloadResponse
 from manager.database_utils.r2_storage import R2Storage
 from manager.database_utils.url_cache import URLCache
-from manager.LRU_cache.format_cache import FormatCache
+from manager.database_utils.session_index import SessionIndex
+from manager.LRU_cache.format_cache import FormatCache, normalize_youtube_url
+from manager.LRU_cache.LRU_NODE import LRUCache
 from manager.configuation.config import *
 from manager.turnstiles_authentication.turnstile import Turnstile
+from manager.rate_limit.rate_limiter import TokenBucketLimiter
+from manager.rate_limit.redis_rate_limiter import RedisRateLimiter
 from manager.logging.logging_utils import LOGGING_CONFIG
 from logging import getLogger
 from manager.ffmpeg.ffmpeg_tools import FFmpegTools
 
 import random
+from urllib.parse import quote
+import orjson
 
 
 load_dotenv()
 log = getLogger(__name__)
 
 PROJECT_ROOT = pathlib.Path(__file__).parent
-DOWNLOAD_FOLDER = pathlib.Path('downloads')
+# Resolved once at import, every session path is built with a single "/" from here
+DOWNLOAD_FOLDER = (PROJECT_ROOT / DOWNLOAD_FOLDER_PATH).resolve()
 DOWNLOAD_FOLDER.mkdir(parents=True, exist_ok=True)
-rate_limit_cache: Dict[str, list] = {}
-
-def is_rate_limited(ip: str) -> bool:
-    now = time.time()
-    request_times = rate_limit_cache.get(ip, [])
-    request_times = [t for t in request_times if now - t < RATE_WINDOW]
-    if len(request_times) >= RATE_LIMIT:
-        return True
-    request_times.append(now)
-    rate_limit_cache[ip] = request_times
-    return False
+rate_limiter = TokenBucketLimiter(RATE_LIMIT, RATE_WINDOW, RATE_LIMIT_MAX_CLIENTS)
+# Shared across workers when USE_REDIS_RATE_LIMIT is on, otherwise it just defers to rate_limiter
+redis_rate_limiter = RedisRateLimiter(RATE_LIMIT, RATE_WINDOW, rate_limiter)
+
+PREFERRED_EXTENSIONS = (
+    "mp4", "mkv", "webm", "flv", "3gp", "mov", "avi", "ts",
+    "m4a", "mp3", "ogg", "opus", "flac", "wav", "aac", "alac", "aiff", "dsf", "pcm",
+)
+EXT_PRIORITY: Dict[str, int] = {ext: i for i, ext in enumerate(PREFERRED_EXTENSIONS)}
+TROLL_MESSAGES = (
+    "Yo mon frère, y'a rien ici. Va coder au lieu de fouiller. 🗿🇫🇷",
+    "Eh oh, t'as cru trouver quoi ici ? Retourne bosser ! 🥖",
+    "Bien essayé mon gars, mais y'a que des baguettes ici. 🥖🇫🇷",
+    "Mdr, t'es vraiment en train de chercher des .env ? Trop fort ! 😂",
+    "Nope ! Pas de fichiers secrets ici, juste du saucisson. 🍖",
+    "Oh là là, encore un petit malin qui fouine ! Allez, retourne coder. 🐌",
+    "C'est pas bien de fouiller comme ça ! Tiens, prends un croissant 🥐",
+    "404 Baguette Not Found. Réessaie plus tard ! 🥖❌"
+)
+# Canonical lowercase form produced by str(uuid.uuid4())
+UUID4_REGEX = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-4[0-9a-f]{3}-[89ab][0-9a-f]{3}-[0-9a-f]{12}\Z")
+
+def prune_rate_limit_cache() -> None:
+    """Drop idle clients so one-shot IPs don't pile up"""
+    rate_limiter.prune()
 
 auth_scheme = HTTPBearer(auto_error=False)
 
@@ -61,11 +86,31 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(auth_scheme
     return True
 
 
+class MediaFileResponse(FileResponse):
+    """FileResponse with 1 MiB reads, downloads are hundreds of MB so 64 KiB chunks mean thousands of loop turns"""
+    chunk_size = 1 << 20
+
+
+def x_accel_response(session_id: str, filename: str) -> Response:
+    """
+    Empty response that tells nginx to send DOWNLOAD_FOLDER/<session_id>/<filename> itself (sendfile),
+    so the worker is free as soon as the headers are out.
+    """
+    quoted = quote(filename)
+    if quoted != filename:
+        disposition = f"attachment; filename*=utf-8''{quoted}"
+    else:
+        disposition = f'attachment; filename="{filename}"'
+    return Response(headers={"X-Accel-Redirect": f"{X_ACCEL_PREFIX}/{session_id}/{quoted}",
+                             "Content-Disposition": disposition},
+                    media_type="application/octet-stream")
+
+
 class RateLimitMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
         ip = request.client.host
-        if is_rate_limited(ip):
-            return JSONResponse(
+        if await redis_rate_limiter.is_limited(ip):
+            return ORJSONResponse(
                 status_code=429,
                 content={"detail": "Too many requests"},
             )
@@ -73,122 +118,167 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
 
 class FileSession:
     def __init__(self):
-        self.sessions = deque()
-        self.storage: dict[str, tuple[pathlib.Path, float]] = {}
+        self._expiry_heap: list[tuple[float, str]] = []  # (expiry timestamp, session_id)
+        # Local session folder (Path) or, once uploaded, the R2 object key (str). Expiry lives in _expiry_heap
+        self.storage: dict[str, pathlib.Path | str] = {}
+        self.media_files: dict[str, pathlib.Path] = {}  # Resolved local media file, saves a folder scan per GET
+        self.presigned_urls: dict[str, tuple[str, float]] = {}  # session_id -> (url, signed_at)
         self._task = None
+        self._wakeup = Event()  # Set when a session expires sooner than whatever the cleanup task is sleeping on
         self.r2_storage = R2Storage()
         self.url_cache = URLCache()
+        self.session_index = SessionIndex()  # Shared between workers, in-memory storage stays the fast path
         self.format_cache = FormatCache(capacity=1000, expire_seconds=1800)  # 30 minutes expiration
-        self._upload_tasks: dict[str, create_task] = {}  # Track upload tasks
+        # Uploads are queued and drained by a fixed set of workers instead of one task per download
+        self._upload_queue: Queue = Queue()
+        self._upload_workers: list = []
 
     async def _upload_to_r2(self, session_id: str, file_path: pathlib.Path, url: str, format_option: str) -> None:
         """
         Asynchronously upload a file to R2 storage with timeout handling.
         """
+        if session_id not in self.storage:
+            # Expired while it waited in the queue, its folder is already gone
+            return
         try:
-            first_file = resolve_file_name_from_folder(str(file_path))
-            full_file_path = file_path / first_file
+            # The media file is usually known already, only scan the folder when it isn't
+            full_file_path = self.media_files.get(session_id)
+            if full_file_path is None:
+                full_file_path = file_path / resolve_file_name_from_folder(str(file_path))
+            first_file = full_file_path.name
             object_name = f"{session_id}/{first_file}"
 
-            # Attempt upload with timeout
-            upload_success = await s2a(self.r2_storage.upload_file)(str(full_file_path), object_name)
-            
+            # Plain worker thread per call, so the upload workers really run in parallel
+            upload_success = await to_thread(self.r2_storage.upload_file, str(full_file_path), object_name)
+
+            if session_id not in self.storage:
+                # Expired during the upload, don't bring the session back
+                if upload_success:
+                    await to_thread(self.r2_storage.delete_file, object_name)
+                return
+
             if upload_success:
-                # Cache the file information
-                self.url_cache.cache_file(
-                    url,
-                    format_option,
-                    {
-                        "session_id": session_id,
-                        "object_name": object_name,
-                        "filename": first_file
-                    },
-                    FILE_EXPIRE_TIME
-                )
-                # Delete local file after successful upload
-                rmtree(file_path)
-                # Store only the filename for reference
-                self.storage[session_id] = (pathlib.Path(first_file), datetime.now(timezone.utc).timestamp())
+                # Switch the session to its object key before anything else awaits, from here on GETs
+                # redirect to R2 and the sweeper deletes the object, not the local folder
+                self.storage[session_id] = object_name
+                self.media_files.pop(session_id, None)
+                if self.session_index.enabled:
+                    await to_thread(self.session_index.update_path, session_id, object_name, "r2")
+                if session_id in self.storage:
+                    # Still live, an expired session's object is already queued for deletion
+                    self.url_cache.cache_file(
+                        url,
+                        format_option,
+                        {
+                            "session_id": session_id,
+                            "object_name": object_name,
+                            "filename": first_file
+                        },
+                        FILE_EXPIRE_TIME
+                    )
+                # Nothing reads the local copy anymore, and the sweeper won't remove it for an R2 session
+                await offload_cleanup(fast_rmtree, file_path, True)
             else:
-                # If R2 upload fails, keep local file as fallback
-                self.storage[session_id] = (file_path, datetime.now(timezone.utc).timestamp())
+                # If R2 upload fails, the local file stays as the session's storage
                 log.warning(f"R2 upload failed for session {session_id}, keeping local file")
 
-        except (AsyncTimeoutError, Exception) as e:
+        except Exception as e:
+            # The local file stays as the session's storage
             log.error(f"Error during R2 upload for session {session_id}: {e}")
-            # Keep local file as fallback
-            self.storage[session_id] = (file_path, datetime.now(timezone.utc).timestamp())
-        finally:
-            # Clean up the task reference
-            if session_id in self._upload_tasks:
-                del self._upload_tasks[session_id]
 
-    def add_session(self, session_id, file_path: pathlib.Path = None, url: str = None, format_option: str = None):
-        """Add a new session with associated file path"""
-        self.sessions.append(session_id)
+    async def add_session(self, session_id, file_path: pathlib.Path | str = None, url: str = None, format_option: str = None,
+                          media_file: pathlib.Path = None):
+        """Add a new session with its local folder, or its R2 object key if it is already uploaded"""
+        if file_path and self.session_index.enabled:
+            # Indexed before the upload is queued, so the worker's update_path always lands on an existing row.
+            # A str is already the R2 object key, a Path the local session folder
+            await to_thread(self.session_index.add_session, session_id, str(file_path), FILE_EXPIRE_TIME,
+                            "r2" if isinstance(file_path, str) else "local")
+        expiry = time.monotonic() + FILE_EXPIRE_TIME
+        if not self._expiry_heap or expiry < self._expiry_heap[0][0]:
+            self._wakeup.set()
+        heapq.heappush(self._expiry_heap, (expiry, session_id))
+        if media_file:
+            self.media_files[session_id] = media_file
         if file_path:
             if self.r2_storage.enabled and url and format_option:
-                # Create async task for R2 upload
-                upload_task = create_task(self._upload_to_r2(session_id, file_path, url, format_option))
-                self._upload_tasks[session_id] = upload_task
+                # Hand the upload to the worker pool
+                self._upload_queue.put_nowait((session_id, file_path, url, format_option))
                 # Initially store the local path until upload completes
-                self.storage[session_id] = (file_path, datetime.now(timezone.utc).timestamp())
+                self.storage[session_id] = file_path
             else:
                 # If R2 is not enabled, store locally with full path
-                self.storage[session_id] = (file_path, datetime.now(timezone.utc).timestamp())
+                self.storage[session_id] = file_path
 
             log.debug("Added session: %s with storage type: %s", 
                      session_id, 
                      "R2 (uploading)" if self.r2_storage.enabled else "local")
 
-    def __pop_session(self):
-        if self.sessions:
-            return self.sessions.popleft()
-        return None
-
     async def auto_delete_file_task(self):
+        next_housekeeping = time.monotonic() + 60
         while True:
-            await sleep(60)
-            expired_sessions = []
-            now = datetime.now(timezone.utc).timestamp()
-
-            for session_id, (file_path, created_time) in list(self.storage.items()):
-                if now - created_time >= FILE_EXPIRE_TIME:
-                    try:
-                        # Handle local storage cleanup
-                        if not self.r2_storage.enabled:
-                            # For local storage, file_path is the full path to the session directory
-                            full_path = file_path if isinstance(file_path, pathlib.Path) else DOWNLOAD_FOLDER / session_id
-                            if DISABLE_AUTO_CLEANUP:
-                                log.debug("Skipping cleanup for local session: %s", session_id)
-                                continue
-                            if full_path.exists():
-                                log.debug("Cleaning up local session: %s", session_id)
-                                rmtree(full_path)
-                        
-                        # Handle R2 storage cleanup
-                        elif self.r2_storage.enabled:
-                            # For R2 storage, file_path is just the filename
-                            filename = file_path.name if isinstance(file_path, pathlib.Path) else file_path
-                            object_name = f"{session_id}/{filename}"
-                            await s2a(self.r2_storage.delete_file)(object_name)
-                        
-                        # Handle cache cleanup (both Redis and in-memory)
-                        if self.url_cache.enabled:
-                            self.url_cache.remove_all_by_session(session_id)
-                        
-                        expired_sessions.append(session_id)
-                        
-                    except Exception as e:
-                        log.error(f"Error during cleanup for session {session_id}: {e}")
-
-            # Remove expired sessions from tracking
-            for session_id in expired_sessions:
+            # Sleep until the next session expires, but still tick at least once a minute for housekeeping
+            delay = 60
+            if self._expiry_heap:
+                delay = min(60, max(0, self._expiry_heap[0][0] - time.monotonic()))
+            self._wakeup.clear()
+            try:
+                await wait_for(self._wakeup.wait(), timeout=delay)
+                # A session now expires earlier than what we were waiting for, recompute the delay
+                continue
+            except AsyncTimeoutError:
+                pass
+            now = time.monotonic()
+            r2_expired: list[str] = []  # Deleted in one batch after the sweep
+            expired_sessions: list[str] = []  # Their URL cache entries too
+
+            # Only pop sessions that have actually expired, the heap top is always the oldest one
+            while self._expiry_heap and self._expiry_heap[0][0] <= now:
+                _, session_id = heapq.heappop(self._expiry_heap)
+                # Single lookup, the heap entry is gone so the session is never looked at again anyway
+                file_path = self.storage.pop(session_id, None)
+                if file_path is None:
+                    continue
+                # The session is gone either way, drop its bookkeeping even when the files are kept
+                media_file = self.media_files.pop(session_id, None)
+                expired_sessions.append(session_id)
+                self.presigned_urls.pop(session_id, None)
+
                 try:
-                    self.sessions.remove(session_id)
-                    del self.storage[session_id]
+                    # Handle R2 storage cleanup, the entry is the object key
+                    if isinstance(file_path, str):
+                        r2_expired.append(file_path)
+
+                    # Handle local storage cleanup, including R2 sessions whose upload failed
+                    elif DISABLE_AUTO_CLEANUP:
+                        log.debug("Keeping files of expired local session: %s", session_id)
+                    else:
+                        log.debug("Cleaning up local session: %s", session_id)
+                        # Removal is blocking, keep it off the event loop
+                        await offload_cleanup(remove_session_folder, file_path, media_file)
+
                 except Exception as e:
-                    log.error(f"Error removing session {session_id} from tracking: {e}")
+                    log.error(f"Error during cleanup for session {session_id}: {e}")
+
+            if r2_expired:
+                await to_thread(self.r2_storage.delete_files, r2_expired)
+            # Handle cache cleanup, one batch instead of blocking the loop on Redis for every session
+            if expired_sessions:
+                if self.session_index.enabled:
+                    await to_thread(self.session_index.remove_sessions, expired_sessions)
+                if self.url_cache.enabled:
+                    await to_thread(self.url_cache.remove_all_by_sessions, expired_sessions)
+                else:
+                    # The in-memory cache is only touched from the event loop
+                    self.url_cache.remove_all_by_sessions(expired_sessions)
+
+            # Once a minute at most, bursts of expiring sessions wake the loop far more often than that
+            if now >= next_housekeeping:
+                next_housekeeping = now + 60
+                # Drop rows left behind by workers that are gone
+                if self.session_index.enabled:
+                    await to_thread(self.session_index.purge_expired)
+                prune_rate_limit_cache()
 
     async def clear_sessions(self):
         """
@@ -199,81 +289,107 @@ class FileSession:
         cleaned = 0
         errors = 0
 
-        # Wait for any pending uploads to complete or timeout
-        if self._upload_tasks:
-            log.info(f"Waiting for {len(self._upload_tasks)} pending uploads to complete...")
-            for session_id, task in self._upload_tasks.items():
-                try:
-                    await task
-                except Exception as e:
-                    log.error(f"Error waiting for upload task {session_id}: {e}")
-
-        while self.sessions:
+        # Wait for any pending uploads to complete
+        if self._upload_workers:
+            if not self._upload_queue.empty():
+                log.info(f"Waiting for {self._upload_queue.qsize()} pending uploads to complete...")
+            await self._upload_queue.join()
+            for worker in self._upload_workers:
+                worker.cancel()
+            self._upload_workers.clear()
+
+        # storage is keyed by session id, so it is the authoritative list of what is still live.
+        # Swap it out instead of copying it, the loop awaits and must not see concurrent inserts
+        storage, self.storage = self.storage, {}
+        r2_objects: list[str] = []
+        for session_id, file_path in storage.items():
             try:
-                session_id = self.__pop_session()
-                file_path = self.storage.get(session_id)
-                
-                if file_path:
-                    try:
-                        if not self.r2_storage.enabled:
-                            if DISABLE_AUTO_CLEANUP:
-                                log.debug("Skipping cleanup for local session: %s", session_id)
-                                continue
-                            full_path = file_path[0] if isinstance(file_path[0], pathlib.Path) else DOWNLOAD_FOLDER / session_id
-                            if full_path.exists():
-                                log.debug("Cleaning up local session: %s", session_id)
-                                rmtree(full_path)
-
-                        elif self.r2_storage.enabled:
-                            # For R2 storage, file_path[0] is just the filename
-                            filename = file_path[0].name if isinstance(file_path[0], pathlib.Path) else file_path[0]
-                            object_name = f"{session_id}/{filename}"
-                            await s2a(self.r2_storage.delete_file)(object_name)
-
-                        if self.url_cache.enabled:
-                            self.url_cache.remove_all_by_session(session_id)
-                        
-                        del self.storage[session_id]
-                        cleaned += 1
-                        
-                    except Exception as e:
-                        errors += 1
-                        log.error(f"Error cleaning up session {session_id}: {e}")
-                        
+                if isinstance(file_path, str):
+                    # Uploaded to R2, the entry is the object key
+                    r2_objects.append(file_path)
+
+                else:
+                    if DISABLE_AUTO_CLEANUP:
+                        log.debug("Skipping cleanup for local session: %s", session_id)
+                        continue
+                    log.debug("Cleaning up local session: %s", session_id)
+                    await offload_cleanup(remove_session_folder, file_path, self.media_files.get(session_id))
+
+                self.media_files.pop(session_id, None)
+                self.presigned_urls.pop(session_id, None)
+                cleaned += 1
+
             except Exception as e:
                 errors += 1
-                log.error(f"Error during session cleanup: {e}")
+                log.error(f"Error cleaning up session {session_id}: {e}")
 
-        log.info("Emergency cleanup completed: %d sessions cleaned, %d errors", cleaned, errors)
+        if r2_objects and not await to_thread(self.r2_storage.delete_files, r2_objects):
+            errors += 1
+        if storage and self.url_cache.enabled and not await to_thread(self.url_cache.remove_all_by_sessions, list(storage)):
+            errors += 1
+        if storage and self.session_index.enabled and not await to_thread(self.session_index.remove_sessions, list(storage)):
+            errors += 1
 
-        try:
-            if DOWNLOAD_FOLDER.exists():
-                for session_dir in DOWNLOAD_FOLDER.iterdir():
-                    if session_dir.is_dir():
-                        try:
-                            rmtree(session_dir)
-                            log.debug("Cleaned up orphaned session directory: %s", session_dir)
-                        except Exception as e:
-                            log.error(f"Error cleaning up orphaned directory {session_dir}: {e}")
-        except Exception as e:
-            log.error(f"Error during final downloads directory cleanup: {e}")
+        self._expiry_heap.clear()
+
+        log.info("Emergency cleanup completed: %d sessions cleaned, %d errors", cleaned, errors)
+        self.session_index.close()
+
+        if DISABLE_AUTO_CLEANUP:
+            return
+        # Leftover folders of this worker's own sessions only, other workers share DOWNLOAD_FOLDER
+        # and may still be serving theirs
+        for session_id in storage:
+            session_dir = DOWNLOAD_FOLDER / session_id
+            try:
+                if session_dir.is_dir():
+                    await offload_cleanup(fast_rmtree, session_dir)
+                    log.debug("Cleaned up orphaned session directory: %s", session_dir)
+            except Exception as e:
+                log.error(f"Error cleaning up orphaned directory {session_dir}: {e}")
 
     def start(self):
         if self._task is None:
             self._task = create_task(self.auto_delete_file_task())
+        if self.r2_storage.enabled and not self._upload_workers:
+            self._upload_workers = [create_task(self._upload_worker()) for _ in range(R2_UPLOAD_WORKERS)]
+
+    async def _upload_worker(self):
+        while True:
+            session_id, file_path, url, format_option = await self._upload_queue.get()
+            try:
+                await self._upload_to_r2(session_id, file_path, url, format_option)
+            finally:
+                self._upload_queue.task_done()
 
-    def get_file_url(self, session_id: str) -> Optional[str]:
-        """Get the file URL, either from R2 or local storage"""
-        file_path = self.storage.get(session_id)
-        if not file_path:
+    async def get_file_url(self, session_id: str) -> Optional[str]:
+        """Get the presigned R2 URL of a session, None when the file is (still) only on local disk"""
+        if not self.r2_storage.enabled:
             return None
-            
-        if self.r2_storage.enabled:
-            # When using R2, file_path[0] is just the filename
-            filename = file_path[0].name if isinstance(file_path[0], pathlib.Path) else file_path[0]
-            object_name = f"{session_id}/{filename}"
-            return self.r2_storage.get_presigned_url(object_name, FILE_EXPIRE_TIME)
-        return None
+
+        object_name = self.storage.get(session_id)
+        if object_name is None:
+            # The session may have been created by another worker, only presign once its upload went through
+            if not self.session_index.enabled:
+                return None
+            object_name = await to_thread(self.session_index.get_object_key, session_id)
+            if not object_name:
+                return None
+        elif not isinstance(object_name, str):
+            # Upload still pending or failed, serve the local copy instead
+            return None
+
+        # Signing is pure CPU but runs on every GET, reuse the URL until 80% of its lifetime has passed
+        now = time.monotonic()
+        cached = self.presigned_urls.get(session_id)
+        if cached is not None and now - cached[1] < FILE_EXPIRE_TIME * 0.8:
+            return cached[0]
+
+        url = self.r2_storage.get_presigned_url(object_name, FILE_EXPIRE_TIME)
+        if url and session_id in self.storage:
+            # Only sessions owned by this worker, their entry is dropped again on expiry
+            self.presigned_urls[session_id] = (url, now)
+        return url
 
 def resolve_file_name_from_folder(path: str) -> str:
     """
@@ -281,25 +397,97 @@ def resolve_file_name_from_folder(path: str) -> str:
     """
     if not path:
         raise ValueError("Path cannot be empty")
-    if not os.path.isdir(path):
+
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_file(follow_symlinks=False):
+                    return entry.name
+    except NotADirectoryError:
         raise ValueError(f"'{path}' is not a directory")
 
-    files = [f for f in os.listdir(path) if os.path.isfile(os.path.join(path, f))]
-    if not files:
-        raise FileNotFoundError(f"No files found in folder: {path}")
+    raise FileNotFoundError(f"No files found in folder: {path}")
 
-    return files[0]
+def fast_rmtree(path: str | pathlib.Path, missing_ok: bool = False) -> None:
+    """
+    Remove a session directory without shutil.rmtree's per-entry lstat and path re-resolution.
+    Session folders are flat, so entries are unlinked relative to an open directory fd.
+    If missing_ok is True, a directory that is already gone is not an error.
+    """
+    try:
+        if os.unlink not in os.supports_dir_fd:
+            rmtree(path)
+            return
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    except FileNotFoundError:
+        if missing_ok:
+            return
+        raise
 
-def is_valid_uuid4(s: str) -> bool:
     try:
-        return str(uuid.UUID(s, version=4)) == s
-    except ValueError:
-        return False
+        with os.scandir(fd) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    fast_rmtree(os.path.join(path, entry.name))
+                else:
+                    os.unlink(entry.name, dir_fd=fd)
+    finally:
+        os.close(fd)
+    os.rmdir(path)
+
+def remove_session_folder(path: str | pathlib.Path, media_file: pathlib.Path = None) -> None:
+    """
+    Remove a session directory, which usually holds just the downloaded media file.
+    When that file is known, unlink + rmdir is tried first and the directory walk only runs
+    if yt-dlp left something else behind (thumbnails, .part files).
+    """
+    if media_file is not None:
+        try:
+            os.unlink(media_file)
+            os.rmdir(path)
+            return
+        except OSError:
+            pass
+    fast_rmtree(path, missing_ok=True)
+
+# Bulk expirations and failed downloads shouldn't be able to take over the default thread pool
+_cleanup_slots = Semaphore(4)
+
+async def offload_cleanup(func, *args) -> None:
+    """Run a blocking removal helper in a worker thread, at most 4 at a time"""
+    async with _cleanup_slots:
+        await to_thread(func, *args)
+
+class UUIDPool:
+    """
+    Hands out uuid4 strings from one batched os.urandom read instead of a syscall per id.
+    """
+    def __init__(self, batch_size: int = 128):
+        self._batch_size = batch_size
+        self._buffer = b""
+        self._offset = 0
+
+    def next(self) -> str:
+        if self._offset >= len(self._buffer):
+            self._buffer = os.urandom(16 * self._batch_size)
+            self._offset = 0
+        raw = bytearray(self._buffer[self._offset:self._offset + 16])
+        self._offset += 16
+        raw[6] = (raw[6] & 0x0f) | 0x40  # version 4
+        raw[8] = (raw[8] & 0x3f) | 0x80  # RFC 4122 variant
+        h = raw.hex()
+        return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+uuid_pool = UUIDPool()
+
+def is_valid_uuid4(s: str) -> bool:
+    return UUID4_REGEX.match(s) is not None
 
 
 class BaseApplication(FastAPI):
     def __init__(self):
         super().__init__(lifespan=self.lifespan,
+                        default_response_class=ORJSONResponse,
                         docs_url="/docs" if IS_DEVELOPMENT else None,
                         redoc_url="/redoc" if IS_DEVELOPMENT else None,
                         openapi_url="/openapi.json" if IS_DEVELOPMENT else None)
@@ -311,12 +499,14 @@ class BaseApplication(FastAPI):
                             , response_model=DownloadResponse, dependencies=[Depends(verify_token)])
 
         self.add_api_route("/files/{session_id}", self.get_downloaded_file, methods=["GET"],
-                            response_class=FileResponse)
+                            response_class=MediaFileResponse)
 
         self.add_api_route("/geo_check", self.check_geo_block, methods=["POST"], response_model=GeoblockData,
                             dependencies=[Depends(verify_token)])
 
-        self.add_api_route("/", self.root, methods=["GET", "HEAD"])
+        self.add_api_route("/", self.root, methods=["GET"])
+        # Health checkers mostly send HEAD, answer those without building a body
+        self.add_api_route("/", self.root_head, methods=["HEAD"], include_in_schema=False)
 
         if ENABLE_TROLLING_ROUTE:
             self.add_api_route("/.env", self.fake_environment, methods=["GET"])
@@ -324,17 +514,37 @@ class BaseApplication(FastAPI):
         self.add_exception_handler(404, self.error_handler)
         self.add_exception_handler(405, self.error_handler)
 
-        self.add_middleware(CORSMiddleware, allow_origins=ALLOWED_ORIGINS,
-                        allow_credentials=False, allow_methods=["*"], allow_headers=["*"])
+        # Only the methods/headers the frontend actually sends, and let browsers cache the preflight
+        self.add_middleware(CORSMiddleware, allow_origins=frozenset(ALLOWED_ORIGINS),
+                        allow_credentials=False, allow_methods=("GET", "POST", "HEAD"),
+                        allow_headers=("content-type", "authorization"), max_age=CORS_MAX_AGE)
         self.add_middleware(RateLimitMiddleware)
 
         self.file_session = FileSession()
         self.ffmpeg_tools = FFmpegTools()
         self.ytdlp_tools = YTDLP_TOOLS(self)
+        # Dedicated pools so long downloads never queue in front of format lookups
+        self._download_pool = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS, thread_name_prefix="ytdlp-download")
+        self._metadata_pool = ThreadPoolExecutor(max_workers=METADATA_WORKERS, thread_name_prefix="ytdlp-metadata")
+        # Optional: run downloads in worker processes so muxing/signature work doesn't hold this process' GIL.
+        # spawn, not fork: forking a process that already runs the event loop and thread pools copies their locks
+        self._download_process_pool = ProcessPoolExecutor(max_workers=DOWNLOAD_WORKERS, mp_context=get_context("spawn")) \
+            if DOWNLOAD_USE_PROCESSES else None
+        self._format_inflight: dict[tuple[str, bool], Task] = {}  # One in-flight extraction per (URL, fetch_subtitle)
+        self.geo_cache = LRUCache(capacity=1024, expire_seconds=600)  # 10 minutes expiration
+        self.http_session: Optional[aiohttp.ClientSession] = None  # Opened in lifespan, needs a running loop
+        # Already absolute and resolved, kept as str so the file route can skip building a Path per request
+        self._base_dir = os.fspath(DOWNLOAD_FOLDER)
+        # Served on every miss, read it once instead of opening the file per request
+        self._gomen_page = (PROJECT_ROOT / "template" / "gomen.html").read_bytes()
         self.uptime = datetime.now(timezone.utc)
 
         if TURNSITE_VERIFICATION:
             self.turnstile = Turnstile(TURNSITE_SECRET_KEY)
+
+        # Routes and uptime are fixed after init, serialize the root payload once instead of on every hit
+        routes = "".join(f"[ [{route.name}] - [{route.methods}] - [{route.path}] ]" for route in self.routes)
+        self._root_body = orjson.dumps({"message": f"Server is running - {routes} - Last restart: {self.uptime.ctime()}"})
         
 
     @asynccontextmanager
@@ -345,41 +555,34 @@ class BaseApplication(FastAPI):
         """
         try:
             self.file_session.start()
+            # One pooled client for outbound API calls, keeps the TLS connection to Google warm between checks
+            self.http_session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=100, ttl_dns_cache=300))
             yield None
         finally:
             await self.file_session.clear_sessions()
+            if self.http_session is not None:
+                await self.http_session.close()
+            await redis_rate_limiter.close()
+            self._download_pool.shutdown(wait=False, cancel_futures=True)
+            self._metadata_pool.shutdown(wait=False, cancel_futures=True)
+            if self._download_process_pool is not None:
+                self._download_process_pool.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    async def run_in_pool(pool: Executor, func, *args, **kwargs):
+        return await get_running_loop().run_in_executor(pool, partial(func, *args, **kwargs))
 
     @staticmethod
     def generate_uuid():
-        return str(uuid.uuid4())
+        return uuid_pool.next()
     
     # ATTACKER TROLLING ROUTE
     async def fake_environment(self):
-        messages = [
-            "Yo mon frère, y'a rien ici. Va coder au lieu de fouiller. 🗿🇫🇷",
-            "Eh oh, t'as cru trouver quoi ici ? Retourne bosser ! 🥖",
-            "Bien essayé mon gars, mais y'a que des baguettes ici. 🥖🇫🇷",
-            "Mdr, t'es vraiment en train de chercher des .env ? Trop fort ! 😂",
-            "Nope ! Pas de fichiers secrets ici, juste du saucisson. 🍖",
-            "Oh là là, encore un petit malin qui fouine ! Allez, retourne coder. 🐌",
-            "C'est pas bien de fouiller comme ça ! Tiens, prends un croissant 🥐",
-            "404 Baguette Not Found. Réessaie plus tard ! 🥖❌"
-        ]
         return {
-            "message": random.choice(messages)
+            "message": random.choice(TROLL_MESSAGES)
         }
     
     async def error_handler(self, request: Request, exc: Exception):
-        messages = [
-            "Yo mon frère, y'a rien ici. Va coder au lieu de fouiller. 🗿🇫🇷",
-            "Eh oh, t'as cru trouver quoi ici ? Retourne bosser ! 🥖",
-            "Bien essayé mon gars, mais y'a que des baguettes ici. 🥖🇫🇷",
-            "Mdr, t'es vraiment en train de chercher des .env ? Trop fort ! 😂",
-            "Nope ! Pas de fichiers secrets ici, juste du saucisson. 🍖",
-            "Oh là là, encore un petit malin qui fouine ! Allez, retourne coder. 🐌",
-            "C'est pas bien de fouiller comme ça ! Tiens, prends un croissant 🥐",
-            "404 Baguette Not Found. Réessaie plus tard ! 🥖❌"
-        ]
         route = request.url.path
         ip = request.client.host
 
@@ -387,7 +590,7 @@ class BaseApplication(FastAPI):
 
 
         return Response(
-            content=random.choice(messages),
+            content=random.choice(TROLL_MESSAGES),
             status_code=200
         )
 
@@ -399,17 +602,56 @@ class BaseApplication(FastAPI):
             raise HTTPException(status_code=400, detail="URL is requied")
 
         video_id = get_video_id(url)
-        GOOGLE_API_V3 = os.environ.get("YOUTUBE_V3_APIKEY", None)
-        if GOOGLE_API_V3 is None:
+        if YOUTUBE_V3_APIKEY is None:
             raise HTTPException(status_code=401, detail="This backend is not configured for geochecking")
 
-        check: GeoblockData = await is_geo_restricted(video_id, GOOGLE_API_V3)
+        # Region restrictions change rarely, skip the Google API round trip on repeat checks
+        try:
+            return self.geo_cache.get(video_id)
+        except KeyError:
+            pass
+
+        check: GeoblockData = await is_geo_restricted(video_id, YOUTUBE_V3_APIKEY, self.http_session)
+        self.geo_cache.put(video_id, check)
 
         return check
 
-    async def fetch_data(self, request: FormatRequest):
+    @staticmethod
+    def stream_data_response(formats, file_name, subtitle_info) -> StreamingResponse:
+        """
+        NDJSON variant of DataResponse: a header line with name/subtitle_info, then one FormatInfo per line.
+        """
+        def generate():
+            yield orjson.dumps({
+                "name": file_name,
+                "subtitle_info": subtitle_info.model_dump() if subtitle_info else None
+            }) + b"\n"
+            for format_info in formats:
+                yield orjson.dumps(format_info.model_dump()) + b"\n"
+
+        return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+    async def _extract_formats(self, url: str, fetch_subtitle: bool):
+        data = await self.run_in_pool(self._metadata_pool, self.ytdlp_tools.fetch_data, url, max_audio=3, fetch_subtitle=fetch_subtitle)
+        if data[0]:
+            # Cache the format information, a caching failure must not fail the requests waiting on it
+            try:
+                self.file_session.format_cache.put_cached_format(url, *data)
+            except Exception as e:
+                log.error(f"Error caching formats for {url}: {e}")
+        return data
+
+    def _format_extraction_done(self, inflight_key: tuple[str, bool], task: Task) -> None:
+        self._format_inflight.pop(inflight_key, None)
+        # Mark the exception as retrieved, every waiter may already be gone
+        if not task.cancelled():
+            task.exception()
+
+    async def fetch_data(self, request: FormatRequest, http_request: Request):
         url = request.url
         fetch_subtitle = request.fetch_subtitle or False
+        # Clients that can parse line by line opt in through the Accept header
+        stream = "application/x-ndjson" in http_request.headers.get("accept", "")
 
         if not url.strip():
             raise HTTPException(status_code=400, detail="URL is required")
@@ -419,22 +661,33 @@ class BaseApplication(FastAPI):
             cached_format = self.file_session.format_cache.get_cached_format(url)
             if cached_format:
                 formats, file_name, subtitle_info = cached_format
-                return DataResponse(
+                if stream:
+                    return self.stream_data_response(formats, file_name, subtitle_info)
+                return DataResponse.model_construct(
                     name=file_name,
                     formats=formats,
                     subtitle_info=subtitle_info
                 )
 
-            # If not in cache, fetch from yt-dlp
-            formats, file_name, subtitle_info = await s2a(self.ytdlp_tools.fetch_data)(url, max_audio=3, fetch_subtitle=fetch_subtitle)
+            # If not in cache, fetch from yt-dlp. Concurrent requests for the same URL share
+            # the first request's extraction instead of starting their own
+            inflight_key = (normalize_youtube_url(url), fetch_subtitle)
+            inflight = self._format_inflight.get(inflight_key)
+            if inflight is None:
+                # A task of its own, so the extraction outlives whichever request happened to start it
+                inflight = create_task(self._extract_formats(url, fetch_subtitle))
+                self._format_inflight[inflight_key] = inflight
+                inflight.add_done_callback(partial(self._format_extraction_done, inflight_key))
+
+            # shield: a cancelled waiter must not cancel the shared task for everyone else
+            formats, file_name, subtitle_info = await shield(inflight)
             if not formats:
                 log.error(f"Fail to load formats for {url}")
                 return Response(status_code=404, content="No formats found")
-            
-            # Cache the format information
-            self.file_session.format_cache.put_cached_format(url, formats, file_name, subtitle_info)
-            
-            return DataResponse(
+
+            if stream:
+                return self.stream_data_response(formats, file_name, subtitle_info)
+            return DataResponse.model_construct(
                 name=file_name,
                 formats=formats,
                 subtitle_info=subtitle_info
@@ -459,78 +712,46 @@ class BaseApplication(FastAPI):
 
         # Check cache first
         cached_file = self.file_session.url_cache.get_cached_file(url, format_option)
-        if cached_file:
-            if self.file_session.r2_storage.enabled:
-                presigned_url = self.file_session.r2_storage.get_presigned_url(
-                    cached_file["object_name"],
-                    FILE_EXPIRE_TIME
-                )
-                if presigned_url:
-                    return DownloadResponse(
-                        message="Download completed (cached)",
-                        filename=cached_file["filename"],
-                        download_link=f"/files/{cached_file['session_id']}",
-                        expires_at=datetime.now(timezone.utc).timestamp() + FILE_EXPIRE_TIME,
-                        expires_in=FILE_EXPIRE_TIME,
-                    )
+        if cached_file and self.file_session.r2_storage.enabled:
+            # Clients resolve the session from download_link and go through /files, which signs (and caches)
+            # the R2 URL itself, so there is nothing to sign here
+            return DownloadResponse.model_construct(
+                message="Download completed (cached)",
+                filename=cached_file["filename"],
+                download_link=f"/files/{cached_file['session_id']}",
+                expires_at=time.time() + FILE_EXPIRE_TIME,
+                expires_in=FILE_EXPIRE_TIME,
+            )
 
         session_id = self.generate_uuid()
-        output = pathlib.Path(os.path.join(DOWNLOAD_FOLDER / session_id))
-        output.mkdir(parents=True, exist_ok=True)
+        output = DOWNLOAD_FOLDER / session_id
+        # mkdir is a blocking syscall, keep it off the event loop in case the disk is slow (NFS, busy volume)
+        await to_thread(output.mkdir, parents=True, exist_ok=True)
 
         try:
-            result = await s2a(self.ytdlp_tools.run_yt_dlp_download)(url, format_option, subtitle, output)
+            if self._download_process_pool is not None and get_provider_from_url(url) != "facebook_story":
+                result = await self.run_in_pool(self._download_process_pool, run_yt_dlp_download_in_process, url, format_option, subtitle, str(output))
+            else:
+                result = await self.run_in_pool(self._download_pool, self.ytdlp_tools.run_yt_dlp_download, url, format_option, subtitle, output)
 
             if result["success"]:
-                filename = resolve_file_name_from_folder(str(output))
+                # yt-dlp reports the final filename, only scan the folder when it couldn't (e.g. FB stories)
+                filename = result.get("filename") or resolve_file_name_from_folder(str(output))
                 full_file_path = output / filename
 
-                # If R2 storage is enabled, try to upload the file
-                if self.file_session.r2_storage.enabled:
-                    object_name = f"{session_id}/{filename}"
-
-                    try:
-                        upload_success = await wait_for(s2a(self.file_session.r2_storage.upload_file)(str(full_file_path), object_name), timeout=70)
-                    except (Timeout, CancelledError):
-                        log.error(f"Upload to R2 timed out for session {session_id}")
-                        upload_success = False
-                    except Exception as e:
-                        log.error(f"Error uploading to R2: {e}")
-                        upload_success = False
-
-                    if upload_success:
-                        # File uploaded to R2 successfully, delete local copy
-                        rmtree(output)
-                        # Cache the file information
-                        self.file_session.url_cache.cache_file(
-                            url,
-                            format_option,
-                            {
-                                "session_id": session_id,
-                                "object_name": object_name,
-                                "filename": filename
-                            },
-                            FILE_EXPIRE_TIME
-                        )
-                        # Store only filename in session
-                        self.file_session.add_session(session_id, pathlib.Path(filename))
-                    else:
-                        # R2 upload failed, keep local file as fallback
-                        self.file_session.add_session(session_id, output)
-                else:
-                    # R2 not enabled, store locally
-                    self.file_session.add_session(session_id, output)
+                # With R2 enabled the session is served from disk until an upload worker has moved it
+                # to R2 (see FileSession._upload_to_r2), so the response doesn't wait on the upload
+                await self.file_session.add_session(session_id, output, url, format_option, media_file=full_file_path)
 
-                return DownloadResponse(
+                return DownloadResponse.model_construct(
                     message="Download completed",
                     filename=filename,
                     download_link=f"/files/{session_id}",
-                    expires_at=datetime.now(timezone.utc).timestamp() + FILE_EXPIRE_TIME,
+                    expires_at=time.time() + FILE_EXPIRE_TIME,
                     expires_in=FILE_EXPIRE_TIME,
                 )
             else:
-                if output.exists():
-                    rmtree(output)
+                await offload_cleanup(fast_rmtree, output, True)
 
                 if result.get("error"):
                     return Response(
@@ -543,15 +764,13 @@ class BaseApplication(FastAPI):
                     status_code=500
                 )
         except yt_dlp.utils.DownloadError:
-            if output.exists():
-                rmtree(output)
+            await offload_cleanup(fast_rmtree, output, True)
             return Response(
                 content="Download failed",
                 status_code=500,
             )
         except FileNotFoundError:
-            if output.exists():
-                rmtree(output)
+            await offload_cleanup(fast_rmtree, output, True)
             return Response(
                 content="Download Failed",
                 status_code=500
@@ -563,34 +782,67 @@ class BaseApplication(FastAPI):
 
         # Check if we have an R2 URL
         if self.file_session.r2_storage.enabled:
-            r2_url = self.file_session.get_file_url(session_id)
+            r2_url = await self.file_session.get_file_url(session_id)
             if r2_url:
                 return RedirectResponse(url=r2_url)
 
-        base_dir = (PROJECT_ROOT / DOWNLOAD_FOLDER).resolve()
-        requested_path = (base_dir / session_id).resolve()
-
-        if not str(requested_path).startswith(str(base_dir)):
-            raise HTTPException(403, detail="Forbidden path access")
+        # Known session, the media file was resolved when the download finished
+        media_file = self.file_session.media_files.get(session_id)
+        if media_file is not None:
+            try:
+                stat_result = os.stat(media_file)
+            except FileNotFoundError:
+                pass
+            else:
+                if USE_X_ACCEL:
+                    return x_accel_response(session_id, media_file.name)
+                return MediaFileResponse(path=media_file, filename=media_file.name, media_type='application/octet-stream',
+                                         stat_result=stat_result)
+
+        # session_id is a strict uuid4 at this point, it cannot contain "/" or "..",
+        # so there is no traversal to guard against and no need to resolve() the path
+        requested_path = f"{self._base_dir}{os.sep}{session_id}"
+
+        # Single directory pass, keep the entry with the best extension rank
+        best = None
+        best_rank = len(EXT_PRIORITY)
+        try:
+            # Context manager so the directory fd is released right away when we break early
+            with os.scandir(requested_path) as it:
+                for entry in it:
+                    name = entry.name
+                    dot = name.rfind('.')
+                    if dot < 0:
+                        continue
+                    rank = EXT_PRIORITY.get(name[dot + 1:].lower())
+                    if rank is not None and rank < best_rank and entry.is_file(follow_symlinks=False):
+                        best, best_rank = entry, rank
+                        if rank == 0:
+                            break
+        except FileNotFoundError:
+            pass
 
-        preferred_extensions = [
-            "mp4", "mkv", "webm", "flv", "3gp", "mov", "avi", "ts",
-            "m4a", "mp3", "ogg", "opus", "flac", "wav", "aac", "alac", "aiff", "dsf", "pcm",
-        ]
-        for ext in preferred_extensions:
-            for f in requested_path.glob(f"*.{ext}"):
-                if f.exists() and f.is_file():
-                    return FileResponse(path=f, filename=f.name, media_type='application/octet-stream')
+        if best is not None:
+            if USE_X_ACCEL:
+                return x_accel_response(session_id, best.name)
+            # Hand the stat over so Starlette doesn't stat the file a second time
+            return MediaFileResponse(path=best.path, filename=best.name, media_type='application/octet-stream',
+                                     stat_result=best.stat())
 
-        return HTMLResponse(content=open("template/gomen.html").read())
+        return HTMLResponse(content=self._gomen_page)
     
     async def root(self):
-        beautiful_format = ""
-        for route in self.routes:
-            beautiful_format += f"[ [{route.name}] - [{route.methods}] - [{route.path}] ]"
-        return {"message": f"Server is running - {beautiful_format} - Last restart: {self.uptime.ctime()}"}
+        return Response(content=self._root_body, media_type="application/json")
+
+    async def root_head(self):
+        return Response(media_type="application/json")
 
 if __name__ == "__main__":
     import uvicorn
     log.info(f"YT-DLP VERSION: {yt_dlp.version.__version__}")
-    uvicorn.run(BaseApplication, host="0.0.0.0", port=8000, log_config=LOGGING_CONFIG, forwarded_allow_ips=UVICORN_FORWARDED_ORIGINS)
\ No newline at end of file
+    # Import string instead of an instance so UVICORN_WORKERS > 1 works, each worker imports the module and builds its own app
+    uvicorn.run("backendv2:app", host="0.0.0.0", port=8000, workers=UVICORN_WORKERS, log_config=LOGGING_CONFIG,
+                forwarded_allow_ips=UVICORN_FORWARDED_ORIGINS)
+elif __name__ != "__mp_main__":
+    # `uvicorn backendv2:app`, skipped in download worker processes which re-import this file as __mp_main__
+    app = BaseApplication()
\ No newline at end of file
@@ -1,8 +1,9 @@
-from datetime import datetime
+import time
 from typing import Optional
 
 def get_current_time() -> int:
-    return int(datetime.now().timestamp())
+    # Only used for expiry arithmetic, monotonic is cheaper and immune to clock jumps
+    return int(time.monotonic())
 
 class LRUCacheNode:
     __slots__ = "key", "value", "last_access_timestamp", "prev_key", "next_key"
@@ -1,5 +1,5 @@
 from manager.LRU_cache.LRU_NODE import LRUCache
-from manager.ytdlp_tool.ytdl_tools import FormatInfo
+from manager.models.request_class import FormatInfo
 from manager.models.subtitle_model import SubtitleInfo
 from typing import Optional, Tuple, List
 import re
@@ -8,6 +8,9 @@ from logging import getLogger
 
 log = getLogger(__name__)
 
+# YouTube video ID patterns (watch/embed/v/youtu.be and shorts) in one alternation, compiled once
+YOUTUBE_ID_REGEX = re.compile(r'(?:youtube\.com/(?:[^/]+/.+/|(?:v|e(?:mbed)?)/|.*[?&]v=|shorts/)|youtu\.be/)([^"&?/\s]{11})')
+
 def normalize_youtube_url(url: str) -> str:
     """
     Normalize YouTube URLs to a consistent format for caching.
@@ -21,18 +24,29 @@ def normalize_youtube_url(url: str) -> str:
     Returns:
         Normalized URL in format "youtube:VIDEO_ID"
     """
-    # YouTube video ID patterns
-    youtube_patterns = [
-        r'(?:youtube\.com/(?:[^/]+/.+/|(?:v|e(?:mbed)?)/|.*[?&]v=)|youtu\.be/)([^"&?/\s]{11})',
-        r'youtube\.com/shorts/([^"&?/\s]{11})'
-    ]
-    
-    for pattern in youtube_patterns:
-        match = re.search(pattern, url)
-        if match:
-            video_id = match.group(1)
-            return f"youtube:{video_id}"
-    
+    # Every pattern needs "youtu", skip the parsing entirely for other providers
+    if "youtu" not in url:
+        return url
+
+    # Only a real YouTube host may map onto a video id, otherwise a URL like
+    # https://evil.example/?u=youtube.com/watch?v=ID would share the real video's cache entry
+    try:
+        parsed = urlparse(url if "://" in url else f"//{url}")
+        host = (parsed.hostname or "").lower()
+    except ValueError:  # e.g. a malformed IPv6 netloc
+        return url
+    if host == "youtu.be":
+        target = f"youtu.be{parsed.path}"
+    elif host == "youtube.com" or host.endswith(".youtube.com"):
+        target = f"youtube.com{parsed.path}?{parsed.query}"
+    else:
+        return url
+
+    # Anchored at the verified host so the id can't come from somewhere else in the URL
+    match = YOUTUBE_ID_REGEX.match(target)
+    if match:
+        return f"youtube:{match.group(1)}"
+
     # If no pattern matches, return original URL
     return url
 
@@ -52,15 +66,9 @@ class FormatCache(LRUCache):
             Tuple of (format_list, filename, subtitle_info) if found in cache, None otherwise
         """
         try:
-            normalized_url = normalize_youtube_url(url)
-            cached_data = self.get(normalized_url)
-            if cached_data:
-                return cached_data
+            return self.get(normalize_youtube_url(url))
         except KeyError:
-            # Miss cache, return nothing 
-            return None
-        except Exception as e:
-            log.error(f"Error getting cached format for {url}: {e}")
+            # Miss cache, return nothing
             return None
 
     def put_cached_format(self, url: str, format_data: List[FormatInfo], filename: str, subtitle_info: Optional[SubtitleInfo]) -> None:
@@ -73,11 +81,7 @@ class FormatCache(LRUCache):
             filename: The filename associated with the URL
             subtitle_info: Optional subtitle information
         """
-        try:
-            normalized_url = normalize_youtube_url(url)
-            self.put(normalized_url, (format_data, filename, subtitle_info))
-        except Exception as e:
-            log.error(f"Error putting cached format for {url}: {e}")
+        self.put(normalize_youtube_url(url), (format_data, filename, subtitle_info))
 
     def delete_cached_format(self, url: str) -> None:
         """
@@ -86,10 +90,6 @@ class FormatCache(LRUCache):
         Args:
             url: The URL to delete format information for
         """
-        try:
-            normalized_url = normalize_youtube_url(url)
-            self.delete(normalized_url)
-        except Exception as e:
-            log.error(f"Error deleting cached format for {url}: {e}")
+        self.delete(normalize_youtube_url(url))
 
 
@@ -5,12 +5,26 @@ import pathlib
 load_dotenv()
 
 ALLOWED_ORIGINS = os.environ.get("ALLOWED_ORIGINS", "*").split("||")
+CORS_MAX_AGE = int(os.environ.get("CORS_MAX_AGE", 86400))
 UVICORN_FORWARDED_ORIGINS = os.environ.get("FORWARDED_ORIGINS", "*").split("||")
+UVICORN_WORKERS = int(os.environ.get("UVICORN_WORKERS", 1))
 ENABLE_TROLLING_ROUTE = os.environ.get("ENABLE_TROLLING_ROUTE", "False").lower() == "true"
 DISABLE_AUTO_CLEANUP = os.environ.get("KEEP_LOCAL_FILES", "False").lower() == "true"
 TURNSITE_VERIFICATION = os.environ.get("TURNSITE_VERIFICATION", "False").lower() == "true"
 TURNSITE_SECRET_KEY = os.environ.get("TURNSITE_API_SECRECT_KEY", "youshallnotpassanysecretkey")
 MAX_FILE_SIZE = int(os.environ.get("MAX_FILE_SIZE", 1024))
+YOUTUBE_V3_APIKEY = os.environ.get("YOUTUBE_V3_APIKEY", None)
+RATE_LIMIT_MAX_CLIENTS = int(os.environ.get("RATE_LIMIT_MAX_CLIENTS", 100_000))
+DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", os.cpu_count() or 4))
+METADATA_WORKERS = int(os.environ.get("METADATA_WORKERS", 16))
+R2_UPLOAD_WORKERS = int(os.environ.get("R2_UPLOAD_WORKERS", 4))
+FFMPEG_WORKERS = int(os.environ.get("FFMPEG_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+DOWNLOAD_USE_PROCESSES = os.environ.get("DOWNLOAD_USE_PROCESSES", "False").lower() == "true"
+# Let nginx serve finished files through X-Accel-Redirect (local storage only)
+USE_X_ACCEL = os.environ.get("USE_X_ACCEL", "False").lower() == "true"
+X_ACCEL_PREFIX = os.environ.get("X_ACCEL_PREFIX", "/internal").rstrip("/")
+DOWNLOAD_FOLDER_PATH = os.environ.get("DOWNLOAD_FOLDER", "downloads")
+DOWNLOAD_TEMP_FOLDER_PATH = os.environ.get("DOWNLOAD_TEMP_FOLDER") or None
 
 if os.environ.get("FILE_EXPIRE_TIME") is not None and os.environ.get("FILE_EXPIRE_TIME").isdigit():
     FILE_EXPIRE_TIME: int = int(os.environ.get("FILE_EXPIRE_TIME"))
@@ -1,5 +1,6 @@
 import boto3
 from botocore.client import Config
+from boto3.s3.transfer import TransferConfig
 import os
 from typing import Optional, BinaryIO
 from datetime import datetime, timedelta
@@ -26,7 +27,19 @@ class R2Storage:
             endpoint_url=f'https://{self.account_id}.r2.cloudflarestorage.com',
             aws_access_key_id=self.access_key_id,
             aws_secret_access_key=self.secret_access_key,
-            config=Config(signature_version='s3v4'),
+            # Shared by every upload worker thread, each multipart upload uses up to max_concurrency connections
+            config=Config(
+                signature_version='s3v4',
+                max_pool_connections=64,
+                tcp_keepalive=True,
+                retries={'max_attempts': 3, 'mode': 'adaptive'}
+            ),
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=16 * 1024 * 1024,
+            multipart_chunksize=16 * 1024 * 1024,
+            max_concurrency=10,
+            use_threads=True
         )
 
     def upload_file(self, file_path: str, object_name: Optional[str] = None) -> bool:
@@ -39,7 +52,7 @@ class R2Storage:
 
         try:
             log.info(f"Uploading file to R2: {file_path} -> {object_name}")
-            self.s3.upload_file(file_path, self.bucket_name, object_name)
+            self.s3.upload_file(file_path, self.bucket_name, object_name, Config=self.transfer_config)
             return True
         except Exception as e:
             log.error(f"Error uploading file to R2: {e}")
@@ -51,7 +64,7 @@ class R2Storage:
             return False
 
         try:
-            self.s3.upload_fileobj(file_obj, self.bucket_name, object_name)
+            self.s3.upload_fileobj(file_obj, self.bucket_name, object_name, Config=self.transfer_config)
             return True
         except Exception as e:
             log.error(f"Error uploading file object to R2: {e}")
@@ -63,7 +76,7 @@ class R2Storage:
             return False
 
         try:
-            self.s3.download_file(self.bucket_name, object_name, file_path)
+            self.s3.download_file(self.bucket_name, object_name, file_path, Config=self.transfer_config)
             return True
         except Exception as e:
             log.error(f"Error downloading file from R2: {e}")
@@ -98,4 +111,25 @@ class R2Storage:
             return True
         except Exception as e:
             log.error(f"Error deleting file from R2: {e}")
-            return False 
\ No newline at end of file
+            return False 
+
+    def delete_files(self, object_names: list[str]) -> bool:
+        """Delete many files from R2 storage, one request per 1000 keys (the S3 DeleteObjects limit)"""
+        if not self.enabled:
+            return False
+
+        success = True
+        for i in range(0, len(object_names), 1000):
+            batch = object_names[i:i + 1000]
+            try:
+                response = self.s3.delete_objects(
+                    Bucket=self.bucket_name,
+                    Delete={'Objects': [{'Key': name} for name in batch], 'Quiet': True}
+                )
+                for error in response.get('Errors', ()):
+                    success = False
+                    log.error(f"Error deleting file from R2: {error.get('Key')}: {error.get('Message')}")
+            except Exception as e:
+                success = False
+                log.error(f"Error deleting {len(batch)} files from R2: {e}")
+        return success
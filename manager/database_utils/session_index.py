@@ -0,0 +1,112 @@
+import sqlite3
+import threading
+import os
+import time
+from typing import Optional
+import logging
+
+log = logging.getLogger(__name__)
+
+class SessionIndex:
+    """
+    Shared on-disk index of live download sessions.
+    Lets every uvicorn worker resolve a session created by another worker.
+    """
+    def __init__(self):
+        self.enabled = os.environ.get("USE_SESSION_INDEX", "false").lower() == "true"
+        if not self.enabled:
+            return
+
+        db_path = os.environ.get("SESSION_INDEX_PATH", "sessions.db")
+        # Give up quickly on a locked database instead of sqlite's default 5s, a miss only costs a fallback
+        busy_timeout = float(os.environ.get("SESSION_INDEX_TIMEOUT", 0.5))
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=busy_timeout, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        # kind: "local" when path is the session folder, "r2" when it is the R2 object key
+        self.conn.execute("CREATE TABLE IF NOT EXISTS sessions(id TEXT PRIMARY KEY, path TEXT NOT NULL, expiry REAL NOT NULL, kind TEXT NOT NULL DEFAULT 'local')")
+        try:
+            # Index files created before the kind column existed
+            self.conn.execute("ALTER TABLE sessions ADD COLUMN kind TEXT NOT NULL DEFAULT 'local'")
+        except sqlite3.OperationalError:
+            pass
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expiry ON sessions(expiry)")
+
+    def add_session(self, session_id: str, path: str, expire_time: int, kind: str = "local") -> bool:
+        """Insert or replace a session, expiry is stored as wall-clock time so it is valid across processes"""
+        if not self.enabled:
+            return False
+
+        try:
+            with self.lock:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO sessions(id, path, expiry, kind) VALUES (?, ?, ?, ?)",
+                    (session_id, path, time.time() + expire_time, kind)
+                )
+            return True
+        except Exception as e:
+            log.error(f"Error adding session {session_id} to index: {e}")
+            return False
+
+    def update_path(self, session_id: str, path: str, kind: str = "local") -> bool:
+        """Update the stored path and kind of a session, keeping its expiry"""
+        if not self.enabled:
+            return False
+
+        try:
+            with self.lock:
+                self.conn.execute("UPDATE sessions SET path = ?, kind = ? WHERE id = ?", (path, kind, session_id))
+            return True
+        except Exception as e:
+            log.error(f"Error updating session {session_id} in index: {e}")
+            return False
+
+    def get_object_key(self, session_id: str) -> Optional[str]:
+        """Get the R2 object key of a session, None if it has expired or its file only exists on local disk"""
+        if not self.enabled:
+            return None
+
+        try:
+            with self.lock:
+                row = self.conn.execute(
+                    "SELECT path FROM sessions WHERE id = ? AND expiry > ? AND kind = 'r2'",
+                    (session_id, time.time())
+                ).fetchone()
+            return row[0] if row else None
+        except Exception as e:
+            log.error(f"Error reading session {session_id} from index: {e}")
+            return None
+
+    def remove_sessions(self, session_ids: list[str]) -> bool:
+        """Remove several sessions from the index in one statement batch"""
+        if not self.enabled or not session_ids:
+            return False
+
+        try:
+            with self.lock:
+                self.conn.executemany("DELETE FROM sessions WHERE id = ?", ((session_id,) for session_id in session_ids))
+            return True
+        except Exception as e:
+            log.error(f"Error removing {len(session_ids)} sessions from index: {e}")
+            return False
+
+    def purge_expired(self) -> int:
+        """Drop every expired row, returns the number of rows removed"""
+        if not self.enabled:
+            return 0
+
+        try:
+            with self.lock:
+                cursor = self.conn.execute("DELETE FROM sessions WHERE expiry <= ?", (time.time(),))
+            return cursor.rowcount
+        except Exception as e:
+            log.error(f"Error purging expired sessions from index: {e}")
+            return 0
+
+    def close(self) -> None:
+        if not self.enabled:
+            return
+        with self.lock:
+            self.conn.close()
@@ -1,9 +1,12 @@
 import redis
 import os
-import json
-from typing import Optional, Dict, Any
-from datetime import datetime, timedelta
+import orjson
+from typing import Optional, Dict, Any, List
+import time
 import logging
+from collections import OrderedDict
+from hashlib import blake2b
+from manager.LRU_cache.format_cache import normalize_youtube_url
 
 log = logging.getLogger(__name__)
 
@@ -11,8 +14,11 @@ class URLCache:
     def __init__(self):
         self.enabled = os.environ.get("USE_REDIS_CACHE", "false").lower() == "true"
         if not self.enabled:
-            # Fallback to in-memory cache if Redis is not enabled
-            self.memory_cache: Dict[str, Dict[str, Any]] = {}
+            # Fallback to in-memory cache if Redis is not enabled, bounded LRU
+            self.memory_cache: OrderedDict[str, Dict[str, Any]] = OrderedDict()
+            self.memory_cache_size = int(os.environ.get("MEMORY_CACHE_SIZE", "1024"))
+            # session_id -> cache keys, same role as the session:{id} sets on Redis
+            self._session_index: Dict[str, set] = {}
             return
 
         redis_host = os.environ.get("REDIS_HOST", "localhost")
@@ -23,12 +29,28 @@ class URLCache:
             host=redis_host,
             port=redis_port,
             password=redis_password,
-            decode_responses=True
+            decode_responses=True,
+            # Worker threads share the pool, keep enough warm connections and detect dead ones early
+            max_connections=50,
+            socket_keepalive=True,
+            health_check_interval=30
         )
 
     def _get_cache_key(self, url: str, format_option: str) -> str:
-        """Generate a cache key from URL and format option"""
-        return f"ytdl:{url}:{format_option}"
+        """Generate a fixed-length cache key from URL and format option"""
+        # Same video through a different URL form shares the entry, the digest keeps long URLs off the wire
+        return "ytdl:" + blake2b(f"{normalize_youtube_url(url)}\0{format_option}".encode(), digest_size=16).hexdigest()
+
+    def _forget(self, cache_key: str) -> None:
+        """Drop an in-memory entry along with its session index reference"""
+        cached_data = self.memory_cache.pop(cache_key, None)
+        if cached_data is None:
+            return
+        keys = self._session_index.get(cached_data.get('session_id'))
+        if keys is not None:
+            keys.discard(cache_key)
+            if not keys:
+                del self._session_index[cached_data.get('session_id')]
 
     def get_cached_file(self, url: str, format_option: str) -> Optional[Dict[str, Any]]:
         """Get cached file information if it exists"""
@@ -38,17 +60,17 @@ class URLCache:
             # Use in-memory cache
             cached_data = self.memory_cache.get(cache_key)
             if cached_data:
-                expiry_time = datetime.fromisoformat(cached_data['expiry_time'])
-                if expiry_time > datetime.utcnow():
+                if cached_data['expiry_time'] > time.monotonic():
+                    self.memory_cache.move_to_end(cache_key)
                     return cached_data
                 else:
-                    del self.memory_cache[cache_key]
+                    self._forget(cache_key)
             return None
 
         try:
             cached_data = self.redis.get(cache_key)
             if cached_data:
-                return json.loads(cached_data)
+                return orjson.loads(cached_data)
             return None
         except Exception as e:
             log.error(f"Error retrieving from cache: {e}")
@@ -58,24 +80,28 @@ class URLCache:
                   expire_time: int = 1800) -> bool:
         """Cache file information with expiration"""
         cache_key = self._get_cache_key(url, format_option)
-        expiry_time = datetime.utcnow() + timedelta(seconds=expire_time)
-        file_info['expiry_time'] = expiry_time.isoformat()
 
         if not self.enabled:
-            # Use in-memory cache
+            # Use in-memory cache, expiry is a plain monotonic float so lookups are a single comparison
+            file_info['expiry_time'] = time.monotonic() + expire_time
+            self._forget(cache_key)
             self.memory_cache[cache_key] = file_info
+            self._session_index.setdefault(file_info['session_id'], set()).add(cache_key)
+            if len(self.memory_cache) > self.memory_cache_size:
+                self._forget(next(iter(self.memory_cache)))
             return True
 
+        # Redis expires the key itself, this is informational and has to be valid across processes
+        file_info['expiry_time'] = time.time() + expire_time
+
         try:
-            self.redis.setex(
-                cache_key,
-                expire_time,
-                json.dumps(file_info)
-            )
-            # Store a reverse lookup for session cleanup
+            # Store the entry and a reverse lookup for session cleanup in one round trip
             session_key = f"session:{file_info['session_id']}"
-            self.redis.sadd(session_key, cache_key)
-            self.redis.expire(session_key, expire_time)
+            with self.redis.pipeline(transaction=False) as pipe:
+                pipe.setex(cache_key, expire_time, orjson.dumps(file_info))
+                pipe.sadd(session_key, cache_key)
+                pipe.expire(session_key, expire_time)
+                pipe.execute()
             return True
         except Exception as e:
             log.error(f"Error caching file info: {e}")
@@ -87,8 +113,7 @@ class URLCache:
 
         if not self.enabled:
             # Use in-memory cache
-            if cache_key in self.memory_cache:
-                del self.memory_cache[cache_key]
+            self._forget(cache_key)
             return True
 
         try:
@@ -100,25 +125,29 @@ class URLCache:
 
     def remove_all_by_session(self, session_id: str) -> bool:
         """Remove all cache entries associated with a session ID"""
+        return self.remove_all_by_sessions([session_id])
+
+    def remove_all_by_sessions(self, session_ids: List[str]) -> bool:
+        """Bulk remove_all_by_session, two pipelined round trips on Redis however many sessions expire"""
+        if not session_ids:
+            return True
+
         if not self.enabled:
-            # For in-memory cache, iterate and remove matching entries
-            keys_to_remove = []
-            for key, value in self.memory_cache.items():
-                if value.get('session_id') == session_id:
-                    keys_to_remove.append(key)
-            for key in keys_to_remove:
-                del self.memory_cache[key]
+            for session_id in session_ids:
+                for key in self._session_index.pop(session_id, ()):
+                    self.memory_cache.pop(key, None)
             return True
 
         try:
-            # Get all cache keys associated with this session
-            session_key = f"session:{session_id}"
-            cache_keys = self.redis.smembers(session_key)
-            
-            if cache_keys:
-                # Delete all cache entries and the session set
-                self.redis.delete(*cache_keys, session_key)
+            session_keys = [f"session:{session_id}" for session_id in session_ids]
+            pipe = self.redis.pipeline(transaction=False)
+            for session_key in session_keys:
+                pipe.smembers(session_key)
+            cache_keys = set().union(*pipe.execute())
+
+            # UNLINK frees the values in the background instead of blocking Redis
+            self.redis.unlink(*cache_keys, *session_keys)
             return True
         except Exception as e:
-            log.error(f"Error removing cache for session {session_id}: {e}")
-            return False 
\ No newline at end of file
+            log.error(f"Error removing cache for {len(session_ids)} sessions: {e}")
+            return False
@@ -1,36 +1,128 @@
-import ffmpeg
-import subprocess
+import asyncio
 import os
+import shutil
+from functools import lru_cache
+from typing import Awaitable, Callable, Iterable, Optional
 from logging import getLogger
+from manager.configuation.config import FFMPEG_WORKERS
 
 log = getLogger(__name__)
 
+# Audio codecs each output container can take as-is, anything else has to be re-encoded
+COPYABLE_AUDIO_CODECS = {
+    '.mp4': frozenset({'aac', 'mp3', 'alac', 'ac3', 'eac3', 'opus'}),
+    '.m4a': frozenset({'aac', 'mp3', 'alac', 'ac3', 'eac3', 'opus'}),
+    '.mov': frozenset({'aac', 'mp3', 'alac', 'ac3', 'eac3'}),
+    '.mkv': frozenset({'aac', 'mp3', 'alac', 'ac3', 'eac3', 'opus', 'vorbis', 'flac'}),
+    '.webm': frozenset({'opus', 'vorbis'}),
+}
+
+@lru_cache(maxsize=None)
+def find_executable(name: str) -> Optional[str]:
+    """Resolved path of `name` on PATH, looked up once per process"""
+    return shutil.which(name)
+
 class FFmpegTools:
     """Class to handle merging audio into video files using FFmpeg"""
-    
+
     def __init__(self):
         self.check_ffmpeg()
-    
+
     def check_ffmpeg(self):
         """Check if FFmpeg is installed"""
-        try:
-            subprocess.run(['ffmpeg', '-version'], 
-                         capture_output=True, check=True)
-            log.info("✓ FFmpeg is available")
-        except (subprocess.CalledProcessError, FileNotFoundError):
+        self.ffmpeg_path = find_executable('ffmpeg')
+        if self.ffmpeg_path is None:
             raise RuntimeError("FFmpeg not found. Please install FFmpeg first.")
-    
-    def merge_audio(self, video_path, audio_path, output_path, 
-                                replace_audio=True, audio_codec='aac'):
+        # ffprobe ships with ffmpeg, without it audio is simply always re-encoded
+        self.ffprobe_path = find_executable('ffprobe') or 'ffprobe'
+        log.info(f"✓ FFmpeg is available: {self.ffmpeg_path}")
+
+    async def _run_ffmpeg(self, args: list[str]) -> bool:
+        """
+        Run ffmpeg with `args` as an asyncio subprocess, so the event loop keeps serving while it encodes
+
+        Returns:
+            True if ffmpeg exited cleanly
+        """
+        process = await asyncio.create_subprocess_exec(
+            self.ffmpeg_path, '-hide_banner', '-loglevel', 'error', '-y', *args,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            _, stderr = await process.communicate()
+        except asyncio.CancelledError:
+            # Don't leave an orphan ffmpeg behind when the request goes away
+            process.kill()
+            await process.wait()
+            raise
+
+        if process.returncode != 0:
+            log.error(f"✗ FFmpeg error: exited with code {process.returncode}")
+            if stderr:
+                log.error(f"Error details: {stderr.decode(errors='replace')}")
+            return False
+        return True
+
+    async def _probe_audio_codec(self, path: str) -> Optional[str]:
+        """Codec name of the first audio stream in `path`, None if there is none or ffprobe fails"""
+        try:
+            process = await asyncio.create_subprocess_exec(
+                self.ffprobe_path, '-v', 'error', '-select_streams', 'a:0',
+                '-show_entries', 'stream=codec_name', '-of', 'csv=p=0', path,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL
+            )
+            stdout, _ = await process.communicate()
+        except OSError as e:
+            log.warning(f"ffprobe unavailable, audio will be re-encoded: {e}")
+            return None
+        if process.returncode != 0:
+            return None
+        return stdout.decode().strip() or None
+
+    async def _audio_codec_for(self, audio_path: str, output_path: str, audio_codec: str) -> str:
+        """`copy` when the source audio already fits the output container, `audio_codec` otherwise"""
+        copyable = COPYABLE_AUDIO_CODECS.get(os.path.splitext(output_path)[1].lower())
+        if copyable and await self._probe_audio_codec(audio_path) in copyable:
+            return 'copy'
+        return audio_codec
+
+    async def batch(self, op: Callable[..., Awaitable[bool]], jobs: Iterable[tuple],
+                    max_workers: Optional[int] = None) -> list[bool]:
         """
-        Merge audio into video using ffmpeg-python library
-        
+        Run `op` (one of the methods below) over many independent jobs, at most `max_workers` ffmpeg processes at once
+
+        Args:
+            op: Coroutine method to run, e.g. self.merge_audio
+            jobs: Positional argument tuples, one per call
+            max_workers: Concurrency limit, defaults to FFMPEG_WORKERS
+
+        Returns:
+            One result per job, in the same order
+        """
+        slots = asyncio.Semaphore(max_workers or FFMPEG_WORKERS)
+
+        async def run(args: tuple) -> bool:
+            async with slots:
+                return await op(*args)
+
+        return await asyncio.gather(*(run(args) for args in jobs))
+
+    async def merge_audio(self, video_path, audio_path, output_path,
+                                replace_audio=True, audio_codec='aac', copy_audio=True):
+        """
+        Merge audio into video using FFmpeg
+
         Args:
             video_path: Path to input video file
-            audio_path: Path to input audio file  
+            audio_path: Path to input audio file
             output_path: Path for output file
             replace_audio: If True, replace existing audio. If False, mix with existing
             audio_codec: Audio codec to use (aac, mp3, etc.)
+            copy_audio: Remux the audio stream untouched when the output container supports its codec
         """
         try:
             # Validate input files
@@ -38,93 +130,72 @@ class FFmpegTools:
                 raise FileNotFoundError(f"Video file not found: {video_path}")
             if not os.path.exists(audio_path):
                 raise FileNotFoundError(f"Audio file not found: {audio_path}")
-            
-            # Input streams
-            video_input = ffmpeg.input(video_path)
-            audio_input = ffmpeg.input(audio_path)
-            
+
+            args = ['-i', video_path, '-i', audio_path]
             if replace_audio:
-                # Replace existing audio completely
-                output = ffmpeg.output(
-                    video_input.video,     # video stream only
-                    audio_input.audio,     # audio stream only
-                    output_path,
-                    vcodec='copy',         # copy video without re-encoding
-                    acodec=audio_codec
-                )
+                # Replace existing audio completely, video stream is copied without re-encoding
+                args += ['-map', '0:v', '-map', '1:a']
+                if copy_audio:
+                    audio_codec = await self._audio_codec_for(audio_path, output_path, audio_codec)
             else:
-                # Mix new audio with existing audio
-                # Get existing audio from video
-                video_audio = video_input.audio
-                
-                # Mix the two audio streams
-                mixed_audio = ffmpeg.filter([video_audio, audio_input], 'amix', 
-                                          inputs=2, duration='shortest')
-                
-                output = ffmpeg.output(
-                    video_input.video,
-                    mixed_audio,
-                    output_path,
-                    vcodec='copy',
-                    acodec=audio_codec
-                )
-            
-            # Run the FFmpeg command with error handling
+                # Mix new audio with the audio already in the video
+                args += [
+                    '-filter_complex', '[0:a][1:a]amix=inputs=2:duration=shortest[mixed]',
+                    '-map', '0:v', '-map', '[mixed]'
+                ]
+            args += ['-c:v', 'copy', '-c:a', audio_codec, output_path]
+
             log.info(f"Processing: {video_path} + {audio_path} -> {output_path}")
-            ffmpeg.run(output, overwrite_output=True, quiet=False)
+            if not await self._run_ffmpeg(args):
+                return False
             log.info(f"✓ Successfully merged audio into video: {output_path}")
             return True
-        except ffmpeg.Error as e:
-            log.error(f"✗ FFmpeg error: {e}")
-            if hasattr(e, 'stderr') and e.stderr:
-                log.error(f"Error details: {e.stderr.decode()}")
-            return False
         except FileNotFoundError as e:
             log.error(f"✗ File error: {e}")
             return False
         except Exception as e:
             log.error(f"✗ Unexpected error: {e}")
             return False
-    
 
-    def adjust_audio_sync(self, video_path, audio_path, output_path, 
-                         audio_delay=0.0, audio_codec='aac'):
+
+    async def adjust_audio_sync(self, video_path, audio_path, output_path,
+                         audio_delay=0.0, audio_codec='aac', copy_audio=True):
         """
         Merge audio with video and adjust sync (delay/advance audio)
-        
+
         Args:
             video_path: Path to input video
             audio_path: Path to input audio
             output_path: Path for output
             audio_delay: Delay in seconds (positive = delay, negative = advance)
             audio_codec: Audio codec to use
+            copy_audio: Without a delay, remux the audio stream untouched when the output container supports its codec
         """
         try:
-            video_input = ffmpeg.input(video_path)
-            audio_input = ffmpeg.input(audio_path)
-            
+            args = ['-i', video_path, '-i', audio_path]
+
             # Apply audio delay if specified
             if audio_delay != 0:
-                audio_input = ffmpeg.filter(audio_input, 'adelay', f'{int(audio_delay * 1000)}')
-            
-            output = ffmpeg.output(
-                video_input.video,
-                audio_input,
-                output_path,
-                vcodec='copy',
-                acodec=audio_codec
-            )
-            
-            ffmpeg.run(output, overwrite_output=True)
+                args += ['-filter_complex', f'[1:a]adelay={int(audio_delay * 1000)}[delayed]', '-map', '0:v', '-map', '[delayed]']
+            else:
+                args += ['-map', '0:v', '-map', '1:a']
+                if copy_audio:
+                    audio_codec = await self._audio_codec_for(audio_path, output_path, audio_codec)
+            args += ['-c:v', 'copy', '-c:a', audio_codec, output_path]
+
+            if not await self._run_ffmpeg(args):
+                return False
             log.info(f"✓ Merged with {audio_delay}s audio delay: {output_path}")
-            
+            return True
+
         except Exception as e:
             log.error(f"✗ Error adjusting sync: {e}")
+            return False
 
-    def add_subtitle_as_selectable_track(self, video_path, subtitle_path, output_path):
+    async def add_subtitle_as_selectable_track(self, video_path, subtitle_path, output_path):
         """
-        Add subtitle to video using ffmpeg-python library as a selectable subtitle track
-        
+        Add subtitle to video as a selectable subtitle track
+
         Args:
             video_path: Path to input video file
             subtitle_path: Path to input subtitle file
@@ -135,63 +206,73 @@ class FFmpegTools:
                 raise FileNotFoundError(f"Video file not found: {video_path}")
             if not os.path.exists(subtitle_path):
                 raise FileNotFoundError(f"Subtitle file not found: {subtitle_path}")
-            
-            video = ffmpeg.input(video_path)
-            subtitle = ffmpeg.input(subtitle_path)
-            
-            output = ffmpeg.output(
-                video,
-                subtitle,
-                output_path,
-                map_metadata='-1', 
-                vcodec='copy',     
-                acodec='copy',    
-                scodec='mov_text'  
-            )
 
-            ffmpeg.run(output, overwrite_output=True)
+            args = [
+                '-i', video_path,
+                '-i', subtitle_path,
+                '-map', '0', '-map', '1',
+                '-map_metadata', '-1',
+                '-c:v', 'copy',
+                '-c:a', 'copy',
+                '-c:s', 'mov_text',
+                output_path
+            ]
+
+            if not await self._run_ffmpeg(args):
+                return False
             log.info(f"✓ Successfully added selectable subtitle track to video: {output_path}")
+            return True
 
         except Exception as e:
             log.error(f"✗ Error adding subtitle: {e}")
+            return False
 
-    def add_subtitle_as_burned_in_text(self, video_path, subtitle_path, output_path, preset='veryfast'):
+    async def add_subtitle_as_burned_in_text(self, video_path, subtitle_path, output_path, preset='veryfast',
+                                             threads=0, tune=None, x264opts=None):
         """
-        Add subtitle to video using ffmpeg-python library as a burned-in text
-        
+        Add subtitle to video as a burned-in text
+
         [WARING]: Slow and not recommended for large files
-        
+
         Args:
             video_path: Path to input video file
             subtitle_path: Path to input subtitle file
             output_path: Path for output file
             preset: FFmpeg preset for encoding speed (options: ultrafast, superfast, veryfast, faster, fast, medium, slow, slower, veryslow)
+            threads: Encoder threads, 0 lets x264 use every core
+            tune: Optional x264 tune (e.g. fastdecode, zerolatency)
+            x264opts: Optional raw x264 options (e.g. sliced-threads=1)
         """
         try:
             if not os.path.exists(video_path):
                 raise FileNotFoundError(f"Video file not found: {video_path}")
             if not os.path.exists(subtitle_path):
                 raise FileNotFoundError(f"Subtitle file not found: {subtitle_path}")
-            
+
             log.warning("⚠️ This operation is slow and not recommended for large files")
             log.warning("⚠️ Use add_subtitle_as_selectable_track for faster performance")
             log.warning("⚠️ This may take up to 10 minutes...")
-            
-            output = (
-                ffmpeg
-                .input(video_path)
-                .output(output_path,
-                        vf=f'subtitles={subtitle_path}', 
-                        acodec='copy',
-                        vcodec='h264',
-                        preset=preset,  
-                        crf=23      
-                )
-            )
 
-            ffmpeg.run(output, overwrite_output=True)
+            args = [
+                '-i', video_path,
+                '-vf', f'subtitles={subtitle_path}',
+                '-c:a', 'copy',
+                '-c:v', 'h264',
+                '-preset', preset,
+                '-crf', '23',
+                '-threads', str(threads)
+            ]
+            if tune:
+                args += ['-tune', tune]
+            if x264opts:
+                args += ['-x264opts', x264opts]
+            args.append(output_path)
+
+            if not await self._run_ffmpeg(args):
+                return False
             log.info(f"✓ Successfully added subtitle to video: {output_path}")
+            return True
 
         except Exception as e:
             log.error(f"✗ Error adding subtitle: {e}")
-
+            return False
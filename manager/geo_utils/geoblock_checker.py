@@ -1,8 +1,12 @@
 import aiohttp
 import pycountry
 from pydantic import BaseModel
+from typing import Optional
 from urllib.parse import urlparse, parse_qs
 
+# pycountry loads its database lazily, build the code set once instead of on every check
+ALL_COUNTRIES = frozenset(country.alpha_2 for country in pycountry.countries)
+
 class GeoblockData(BaseModel):
     url: str
     allowed_country: list
@@ -18,33 +22,44 @@ def get_video_id(url: str) -> str:
         query = parse_qs(parsed.query)
         return query.get("v", [""])[0]
 
-async def is_geo_restricted(video_id: str, youtube_api_key: str) -> GeoblockData:
+async def is_geo_restricted(video_id: str, youtube_api_key: str,
+                            session: Optional[aiohttp.ClientSession] = None) -> GeoblockData:
+    """
+    Pass a long-lived session to reuse its pooled connections to googleapis.com,
+    without one a throwaway session is opened for this call.
+    """
+    if session is None:
+        async with aiohttp.ClientSession() as session:
+            return await is_geo_restricted(video_id, youtube_api_key, session)
+
     api_url = (
         f"https://www.googleapis.com/youtube/v3/videos"
         f"?part=contentDetails&id={video_id}&key={youtube_api_key}"
     )
-    async with aiohttp.ClientSession() as session:
-
-        response = await session.get(api_url)
+    async with session.get(api_url) as response:
         if not response.ok:
-            raise Exception(f"API request failed with status code {response.status}: {response.text}")
+            raise Exception(f"API request failed with status code {response.status}: {await response.text()}")
 
         data = await response.json()
-        print(data)
-        items = data.get("items", [])
-        if not items:
-            raise ValueError("No video data returned.")
-        all_countries = {country.alpha_2 for country in pycountry.countries}
-        content_details = items[0].get("contentDetails", {})
-        region_restriction = content_details.get("regionRestriction", {})
-        allowed: list = region_restriction.get("allowed", [])
-        blocked = sorted(all_countries - set(allowed))
 
-        return GeoblockData(
-            url = video_url,
-            allowed_country = allowed_country,
-            blocked_country = blocked
-        )
+    items = data.get("items", [])
+    if not items:
+        raise ValueError("No video data returned.")
+    content_details = items[0].get("contentDetails", {})
+    region_restriction = content_details.get("regionRestriction", {})
+    # The API sends either an allow-list or a block-list, and no regionRestriction at all when nothing is blocked
+    if "allowed" in region_restriction:
+        allowed: list = region_restriction["allowed"]
+        blocked = sorted(ALL_COUNTRIES.difference(allowed))
+    else:
+        blocked = sorted(region_restriction.get("blocked", []))
+        allowed = sorted(ALL_COUNTRIES.difference(blocked))
+
+    return GeoblockData(
+        url = f"https://www.youtube.com/watch?v={video_id}",
+        allowed_country = allowed,
+        blocked_country = blocked
+    )
 
 # Example usage
 if __name__ == "__main__":
@@ -0,0 +1,50 @@
+import time
+
+
+class TokenBucketLimiter:
+    """
+    Per-key token bucket, holds a fixed [tokens, last_refill] pair per client instead of a timestamp history.
+    Allows `limit` requests per `window` seconds with bursts up to `limit`.
+    At most `max_keys` clients are tracked, the least recently seen one is evicted first.
+    """
+    __slots__ = "limit", "window", "rate", "max_keys", "buckets"
+
+    def __init__(self, limit: int, window: int, max_keys: int = 100_000):
+        self.limit: int = limit
+        self.window: int = window
+        self.rate: float = limit / window if window > 0 else 0.0
+        self.max_keys: int = max_keys
+        # Insertion ordered, oldest access first
+        self.buckets: dict[str, list[float]] = {}
+
+    def is_limited(self, key: str) -> bool:
+        if self.window <= 0:
+            # No window means nothing is ever limited (development mode)
+            return False
+
+        now = time.monotonic()
+        bucket = self.buckets.pop(key, None)
+        if bucket is None:
+            if len(self.buckets) >= self.max_keys:
+                # Evicted clients just start over with a full bucket
+                del self.buckets[next(iter(self.buckets))]
+            self.buckets[key] = [self.limit - 1, now]
+            return False
+        # Re-insert to move the client to the most recent end
+        self.buckets[key] = bucket
+
+        tokens = min(self.limit, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            return True
+        bucket[0] = tokens - 1
+        return False
+
+    def prune(self) -> None:
+        """Drop buckets that have refilled completely, they behave the same as a new client"""
+        now = time.monotonic()
+        full = [key for key, (tokens, last) in self.buckets.items()
+                if tokens + (now - last) * self.rate >= self.limit]
+        for key in full:
+            del self.buckets[key]
@@ -0,0 +1,83 @@
+import os
+import time
+import random
+import logging
+from redis import asyncio as aioredis
+
+from manager.rate_limit.rate_limiter import TokenBucketLimiter
+
+log = logging.getLogger(__name__)
+
+# Sliding window log: trim entries older than the window, then only record the hit if it is allowed
+# so rejected requests don't keep pushing the window forward. Returns 1 when the caller is limited.
+SLIDING_WINDOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], 0, now - window)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[3]) then
+    return 1
+end
+redis.call('ZADD', KEYS[1], now, ARGV[4])
+redis.call('PEXPIRE', KEYS[1], math.ceil(window * 1000))
+return 0
+"""
+
+# How long to stay on the local limiter after Redis failed, before trying it again
+REDIS_RETRY_AFTER = 5.0
+
+
+class RedisRateLimiter:
+    """
+    Sliding-window rate limiter shared by every worker through Redis.
+    Falls back to the local token bucket when Redis is disabled or unreachable.
+    """
+    def __init__(self, limit: int, window: int, fallback: TokenBucketLimiter):
+        self.limit = limit
+        self.window = window
+        self.fallback = fallback
+        self.enabled = os.environ.get("USE_REDIS_RATE_LIMIT", "false").lower() == "true" and window > 0
+        if not self.enabled:
+            return
+
+        self.redis = aioredis.Redis(
+            host=os.environ.get("REDIS_HOST", "localhost"),
+            port=int(os.environ.get("REDIS_PORT", "6379")),
+            password=os.environ.get("REDIS_PASSWORD"),
+            # Every request waits on this call, a Redis that stops answering has to fail fast into the local limiter
+            socket_connect_timeout=0.25,
+            socket_timeout=0.25,
+        )
+        # Loaded once with SCRIPT LOAD, then called with EVALSHA
+        self.script = self.redis.register_script(SLIDING_WINDOW_SCRIPT)
+        # Monotonic time until which Redis is skipped, 0 while it is healthy
+        self._down_until = 0.0
+
+    async def is_limited(self, key: str) -> bool:
+        if not self.enabled:
+            return self.fallback.is_limited(key)
+
+        # Circuit open, don't make every request wait out the socket timeout while Redis is down
+        if self._down_until and time.monotonic() < self._down_until:
+            return self.fallback.is_limited(key)
+
+        now = time.time()  # Wall clock, the window is compared across processes
+        try:
+            limited = await self.script(
+                keys=[f"ratelimit:{key}"],
+                args=[now, self.window, self.limit, f"{now}:{random.getrandbits(32)}"]
+            ) == 1
+        except Exception as e:
+            if not self._down_until:
+                # Logged once per outage, retries that fail again just push the deadline
+                log.warning(f"Redis rate limiter unavailable, using local limiter: {e}")
+            self._down_until = time.monotonic() + REDIS_RETRY_AFTER
+            return self.fallback.is_limited(key)
+
+        if self._down_until:
+            self._down_until = 0.0
+            log.info("Redis rate limiter is reachable again")
+        return limited
+
+    async def close(self) -> None:
+        if self.enabled:
+            await self.redis.aclose()
@@ -1,6 +1,6 @@
 import re
 
-YOUTUBE_REGEX = re.compile(r"(?:https?:\/\/)?(?:www\.)?(?:youtube\.(?:com|nl)\/watch\?v=|youtu\.be\/)([a-zA-Z0-9_-]{11})")
+YOUTUBE_REGEX = re.compile(r"(?:https?:\/\/)?(?:(?:www|m|music)\.)?(?:youtube\.(?:com|nl)\/watch\?v=|youtu\.be\/)([a-zA-Z0-9_-]{11})")
 TIKTOK_DEFAULT_REGEX = re.compile(r"https?://(www\.)?tiktok\.com/(?:embed|@([\w\.-]+)/video|t)/(\d+|\w+)")
 TIKTOK_VMVT_REGEX = re.compile(r"https?://(?:vm|vt)\.tiktok\.com/(\w+)")
 INSTAGRAM_REGEX = re.compile(r"https?://(?:www\.)?instagram\.com(?:/[^/]+)?/(?:tv|reel|share)/([^/?#& ]+)")
@@ -20,15 +20,18 @@ PROVIDERS = {
     "facebook_story": FB_STORY_REGEX
 }
 
+# Every provider pattern as one named alternation, so a URL is scanned once instead of once per pattern.
+# Anchored at the start of the URL: only its own scheme/host decides the provider, never a URL
+# embedded further down its path or query
+PROVIDER_REGEX = re.compile("^(?:" + "|".join(
+    f"(?P<{provider}>{'|'.join(p.pattern for p in (patterns if isinstance(patterns, list) else [patterns]))})"
+    for provider, patterns in PROVIDERS.items()
+) + ")")
+
 def get_provider_from_url(url: str) -> str :
-    for provider, patterns in PROVIDERS.items():
-        if isinstance(patterns, list):
-            if any(re.search(p, url) for p in patterns):
-                return provider
-        else:
-            if re.search(patterns, url):
-                return provider
-    return "Unknown"
+    match = PROVIDER_REGEX.match(url.strip())
+    # The provider group encloses the inner ones, so it is the last group to close
+    return match.lastgroup if match else "Unknown"
 
 def is_youtube_playlist(url: str) -> bool:
     return bool(re.search(yt_list_pattern, url))
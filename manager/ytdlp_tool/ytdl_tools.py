@@ -1,5 +1,10 @@
 from typing import Optional
 import asyncio
+import heapq
+from contextlib import contextmanager
+from threading import Lock
+import time
+from queue import Queue, Empty, Full
 from anyio.from_thread import start_blocking_portal
 import yt_dlp
 import pathlib
@@ -12,9 +17,10 @@ from os import environ, path
 import tqdm
 log = getLogger(__name__)
 from manager.models.request_class import FormatInfo
-from manager.LRU_cache.format_cache import FormatCache  
+from manager.LRU_cache.format_cache import FormatCache, normalize_youtube_url
 import aiofiles
-from manager.configuation.config import MAX_FILE_SIZE
+from manager.configuation.config import MAX_FILE_SIZE, DOWNLOAD_TEMP_FOLDER_PATH, DOWNLOAD_USE_PROCESSES, METADATA_WORKERS
+from shutil import rmtree
 from fastapi import FastAPI
 default_formatData = [
     FormatInfo(
@@ -53,6 +59,60 @@ class YTDLP_TOOLS:
         self.app = app
         self.story_cache = FormatCache(capacity=30, expire_seconds=-1)
         self.download_hooks = {}
+        # Idle metadata-only YoutubeDL instances keyed by their options
+        self._ydl_pool: dict[tuple, Queue] = {}
+        # Raw info dicts from fetch_data, a /download right after /fetch_data skips the second extraction
+        self._info_cache: dict[str, tuple[float, dict]] = {}
+        self._info_cache_lock = Lock()
+
+    INFO_CACHE_SIZE = 64
+    INFO_CACHE_TTL = 600  # Well inside the lifetime of YouTube's signed stream URLs
+
+    def put_cached_info(self, url: str, info: dict) -> None:
+        """
+        Cache `info` for `url` as-is, the caller must not change the dict afterwards.
+        Keyed by normalize_youtube_url, which only folds URLs onto a video id once their host is YouTube.
+        """
+        with self._info_cache_lock:
+            self._info_cache[normalize_youtube_url(url)] = (time.monotonic(), info)
+            while len(self._info_cache) > self.INFO_CACHE_SIZE:
+                del self._info_cache[next(iter(self._info_cache))]
+
+    def take_cached_info(self, url: str) -> Optional[dict]:
+        """
+        Pop the info dict cached for `url`, if it is still fresh.
+        It still carries the format /fetch_data resolved, pass it through YoutubeDL.sanitize_info before downloading.
+        """
+        with self._info_cache_lock:
+            entry = self._info_cache.pop(normalize_youtube_url(url), None)
+        if entry is None or time.monotonic() - entry[0] > self.INFO_CACHE_TTL:
+            return None
+        return entry[1]
+
+    @contextmanager
+    def pooled_ydl(self, opt: dict):
+        """
+        Borrow a YoutubeDL built with `opt`, re-using an idle one when possible.
+        Saves the extractor/cookie/opener setup on every call, only use it for download=False work
+        since postprocessors and hooks are fixed at construction.
+        """
+        key = tuple(sorted((k, v) for k, v in opt.items() if k != "logger"))
+        pool = self._ydl_pool.get(key)
+        if pool is None:
+            # No more idle instances than metadata threads that could ever borrow them at once
+            pool = self._ydl_pool.setdefault(key, Queue(maxsize=METADATA_WORKERS))
+        try:
+            ydl = pool.get_nowait()
+        except Empty:
+            ydl = yt_dlp.YoutubeDL(opt)
+        try:
+            yield ydl
+        finally:
+            try:
+                pool.put_nowait(ydl)
+            except Full:
+                # Surplus instance, release its cookie jar and opened files
+                ydl.close()
 
     def get_cookie_file(self, platform: str) -> str:
         """
@@ -240,7 +300,7 @@ class YTDLP_TOOLS:
 
             log.info(f"File sizes: video={video_path.stat().st_size}, audio={audio_path.stat().st_size}")
 
-            ffmpeg_task = self.app.ffmpeg_tools.merge_audio(str(video_path), str(audio_path), str(output_path))
+            ffmpeg_task = await self.app.ffmpeg_tools.merge_audio(str(video_path), str(audio_path), str(output_path))
 
             if not ffmpeg_task:
                 return False
@@ -262,6 +322,31 @@ class YTDLP_TOOLS:
             
             return True
 
+    @staticmethod
+    def selected_file_size(ydl: yt_dlp.YoutubeDL, info: dict, format_option: str) -> int:
+        """
+        Size in bytes of the formats `format_option` picks from `info`, summed over merged streams.
+        The top-level filesize belongs to whichever selection extracted `info`, e.g. fetch_data's default best.
+        """
+        formats = info.get("formats")
+        selected = None
+        if formats:
+            try:
+                selector = ydl.build_format_selector(format_option)
+                # Same context yt-dlp's process_video_result hands to the selector
+                selected = next(iter(selector({
+                    'formats': formats,
+                    'has_merged_format': any('none' not in (f.get('acodec'), f.get('vcodec')) for f in formats),
+                    'incomplete_formats': (all(f.get('vcodec') == 'none' for f in formats)
+                                           or all(f.get('acodec') == 'none' for f in formats)),
+                })), None)
+            except Exception as e:
+                log.warning(f"Could not resolve format {format_option} for the size check: {e}")
+        if selected is None:
+            return info.get("filesize") or info.get("filesize_approx") or 0
+        return sum(f.get("filesize") or f.get("filesize_approx") or 0
+                   for f in selected.get("requested_formats") or [selected])
+
     def fetch_data(self, url: str, max_audio: int = 3, fetch_subtitle: bool = True) -> tuple[
         list[FormatInfo], str | None, Optional[SubtitleInfo]
     ]:
@@ -302,7 +387,7 @@ class YTDLP_TOOLS:
         if platform == "youtube" and is_youtube_playlist(url):
             url = resolve_url(url)
 
-        with yt_dlp.YoutubeDL(opt) as ydl:
+        with self.pooled_ydl(opt) as ydl:
             try:
                 info = ydl.extract_info(url, download=False)
             except yt_dlp.utils.DownloadError as e:
@@ -326,6 +411,10 @@ class YTDLP_TOOLS:
                 print("No formats found in extracted info.")
                 return [], filename, subtitle_info
             
+            # Only a single video with formats can be downloaded next, the dict is only read from here on.
+            # Process workers have their own YTDLP_TOOLS and never read this cache
+            if info.get("_type", "video") == "video" and not DOWNLOAD_USE_PROCESSES:
+                self.put_cached_info(url, info)
             
             log.debug(f"Starting to process formats for {platform} platform")
             
@@ -354,7 +443,7 @@ class YTDLP_TOOLS:
                     label = f"{video_height}p ({video_codec})"
 
                     result.append(
-                        FormatInfo(
+                        FormatInfo.model_construct(
                             type="video+audio",
                             format=f['format_id'],
                             label=label,
@@ -378,43 +467,49 @@ class YTDLP_TOOLS:
                 f for f in raw_formats
                 if f.get("acodec") != "none" and f.get("vcodec") == "none" and f.get("abr")
             ]
-            audio_formats = sorted(audio_formats, key=lambda x: x.get("abr") or 0, reverse=True)[:max_audio]
+            # Only the top max_audio are kept, no need to sort the whole list
+            audio_formats = heapq.nlargest(max_audio, audio_formats, key=lambda x: x.get("abr") or 0)
 
+            # Fields come straight from yt-dlp's format dicts, so FormatInfo entries in this method are
+            # built with model_construct to skip pydantic validation inside the video x audio loop
             result: list[FormatInfo] = []
 
+            # (format_id, rounded kbps) of the audio streams worth pairing, computed once instead of per video
+            paired_audio = []
+            for a in audio_formats:
+                audio_bitrate_kbps = round(a.get('abr', 0), 1)
+                if audio_bitrate_kbps <= 66.7 and platform == "youtube":
+                    continue
+                paired_audio.append((a['format_id'], audio_bitrate_kbps))
+
             for v in sorted(video_formats, key=lambda x: x.get("height") or 0, reverse=True):
                 video_height = v.get("height", 0)
                 video_ext = v.get("ext")
+                video_note = v.get("format_note")
+                video_id = v['format_id']
 
                 if video_ext == "webm" and video_height <= 1080:
                     continue
 
-                if v.get("format_note") is None and platform == "youtube":
+                if video_note is None and platform == "youtube":
                     continue # skip shit
 
-                for a in audio_formats:
-                    audio_bitrate_kbps = round(a.get('abr', 0), 1)
-
-                    if audio_bitrate_kbps <= 66.7 and platform == "youtube":
-                        continue
-
-                    label = f"{video_height}p ({video_ext}) [Audio: {audio_bitrate_kbps}Kbps]".strip()
-
+                for audio_id, audio_bitrate_kbps in paired_audio:
                     result.append(
-                        FormatInfo(
+                        FormatInfo.model_construct(
                             type="video+audio",
-                            format=f"{v['format_id']}+{a['format_id']}",
-                            label=label,
-                            video_format=v['format_id'],
-                            audio_format=a['format_id'],
-                            note=v.get("format_note")
+                            format=f"{video_id}+{audio_id}",
+                            label=f"{video_height}p ({video_ext}) [Audio: {audio_bitrate_kbps}Kbps]",
+                            video_format=video_id,
+                            audio_format=audio_id,
+                            note=video_note
                         )
                     )
 
             for a in audio_formats:
                 label = f"Audio only: {round(a.get('abr', 0), 1)}kbps ({a.get('ext')})"
                 result.append(
-                    FormatInfo(
+                    FormatInfo.model_construct(
                         type="audio-only",
                         format=a['format_id'],
                         label=label,
@@ -427,7 +522,7 @@ class YTDLP_TOOLS:
             for v in video_formats:
                 label = f"Video only: {v.get('height')}p ({v.get('ext')})"
                 result.append(
-                    FormatInfo(
+                    FormatInfo.model_construct(
                         type="video-only",
                         format=v['format_id'],
                         label=label,
@@ -491,11 +586,16 @@ class YTDLP_TOOLS:
         Returns:
             Dictionary with download results
         """
+        # Final path of the file once every postprocessor (merge, subtitle embed) has run
+        captured: dict[str, str] = {}
+
+        def _capture_filename(filepath: str):
+            captured['filename'] = filepath
+
         ydl_opts = {
             'format': format_option,
-            'outtmpl': {
-                'default': str(output) + '/%(title)s.%(ext)s',
-            },
+            'paths': {'home': str(output)},
+            'outtmpl': {'default': '%(title)s.%(ext)s'},
             'keepvideo': False,
             'noplaylist': False,
             'ignoreerrors': True,
@@ -506,8 +606,16 @@ class YTDLP_TOOLS:
             'extract_flat': False,
             'logger': log,
             'progress_hooks': [self.hook_download],
+            'post_hooks': [_capture_filename],
         }
 
+        # .part fragments and pre-merge streams go to the temp folder (e.g. tmpfs),
+        # yt-dlp moves only the final file into the session folder
+        temp_path = None
+        if DOWNLOAD_TEMP_FOLDER_PATH:
+            temp_path = path.join(DOWNLOAD_TEMP_FOLDER_PATH, output.name)
+            ydl_opts['paths']['temp'] = temp_path
+
         if subtitle is not None:
             ydl_opts.update({
                 'writesubtitles': True,
@@ -547,10 +655,21 @@ class YTDLP_TOOLS:
         
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
 
-            # Check the file size
-            info = ydl.extract_info(url, download=False)
+            # Check the file size, reusing the info /fetch_data already extracted when there is one
+            info = self.take_cached_info(url)
+            reused_info = info is not None
+            if reused_info:
+                # Drop requested_formats & co. like download_with_info_file does, so format_option is selected afresh
+                info = ydl.sanitize_info(info, remove_private_keys=True)
+            else:
+                info = ydl.extract_info(url, download=False)
+            if info is None:  # ignoreerrors swallows extraction failures
+                return {
+                    "success": False,
+                    "error": "Extract the video info failed, please contact the developer if this problem persists"
+                }
 
-            file_size = info.get("filesize") or info.get("filesize_approx") or 0
+            file_size = self.selected_file_size(ydl, info, format_option)
 
             log.info(f"File size: {file_size} bytes ({file_size / 1024 / 1024:.2f} MB)")
             if file_size > MAX_FILE_SIZE * 1024 * 1024:
@@ -560,10 +679,20 @@ class YTDLP_TOOLS:
                 }
 
             try:
-                ydl.download([yt_dlp.utils.sanitize_url(url)])
+                # Download from the info we already extracted instead of extracting the URL a second time
+                try:
+                    ydl.process_ie_result(info, download=True)
+                except yt_dlp.utils.DownloadError:
+                    if not reused_info:
+                        raise
+                if reused_info and 'filename' not in captured:
+                    # Cached stream URLs may have gone stale, extract again the way download_with_info_file does
+                    log.warning(f"Download from cached info failed for {url}, extracting it again")
+                    ydl.extract_info(info.get("webpage_url") or url, download=True)
                 return {
                     "success": True,
                     "file_location": output,
+                    "filename": path.basename(captured['filename']) if 'filename' in captured else None,
                 }
             except yt_dlp.utils.DownloadError:
                 return {
@@ -586,4 +715,20 @@ class YTDLP_TOOLS:
                     "success": False,
                     "error": str(e)
                 }
-
+            finally:
+                if temp_path:
+                    rmtree(temp_path, ignore_errors=True)
+
+
+_process_tools: Optional[YTDLP_TOOLS] = None
+
+def run_yt_dlp_download_in_process(url: str, format_option: str, subtitle: str, output: str) -> dict:
+    """
+    Entry point for ProcessPoolExecutor workers, only takes picklable arguments.
+    Each worker process keeps its own YTDLP_TOOLS, FB stories must stay in the app process
+    since they need the story cache and FFmpegTools.
+    """
+    global _process_tools
+    if _process_tools is None:
+        _process_tools = YTDLP_TOOLS(None)
+    return _process_tools.run_yt_dlp_download(url, format_option, subtitle, pathlib.Path(output))